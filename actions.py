@@ -22,6 +22,9 @@ class Action:
                 params += (arg, )
         self.func(*params)
 
+        # actions can write any tiles, anything cached from them (paths, segments) has to be rebuilt
+        floor.tiles_changed()
+
     def add_args(self, *args):
         for arg in args:
             self.args += (arg,)
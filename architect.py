@@ -2,10 +2,13 @@ from __future__ import annotations
 
 
 import random
+import time
 
 import numba.core.types
 import numpy
 import numpy as np
+import navigation
+import profiler
 import tile_types
 
 from numba import njit
@@ -13,6 +16,10 @@ from itertools import product
 from typing import Tuple, List
 
 
+# how many tiles a corridor search may try before giving up on a starting point
+TUNNEL_BUDGET = 2000
+
+
 def neighbor_coords(x: int, y: int) -> List[tuple[int, int]]:
     return [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
 
@@ -24,6 +31,15 @@ class Feature:
         self.x, self.y = x, y
         self.visible, self.explored = None, None
 
+        # connectivity of the floor and walls that can start a corridor, kept up to date as tiles are carved.
+        # None until something asks for them
+        self.segments: SegmentTracker | None = None
+        self._corridor_starts: np.ndarray | None = None
+
+        # goes up on every tile change so caches built from the tiles (like navigation) know when they're stale
+        self.version = 0
+        self._navigation: navigation.NavigationCache | None = None
+
     def in_bounds(self, x, y) -> bool:
         return 0 < x < self.width - 1 and 0 < y < self.height - 1
 
@@ -38,6 +54,10 @@ class Feature:
         # counts walls in given radius of cells centered on x, y
         return np.count_nonzero(self.cells_centered_on(x, y, r) == tile_type)
 
+    def neighbour_counts(self, r: int = 1, tile_type: tile_types.tile_dt = tile_types.wall) -> np.ndarray:
+        # diagonal_tile_count for every cell at once
+        return window_sums(np.asfortranarray(self.tiles == tile_type), r)
+
     def adjacent_tiles(self, x, y) -> np.ndarray:
         return np.asarray([self.tiles[i, j] for (i, j) in neighbor_coords(x, y)]) if self.in_bounds(x, y) else None
 
@@ -52,15 +72,61 @@ class Feature:
         self.visible = np.ones((self.width, self.height), order="F", dtype=bool)
         self.explored = np.ones((self.width, self.height), order="F", dtype=bool)
 
-    def can_corridor(self, x: int, y: int, blobulousness: int = 0) -> bool:
-        # can dig corridor if the tile is in bounds, is a wall, and has enough adjacent walls
-        # awkward calculation with blobulation because I like the var name and think it should start from 0
-        return self.in_bounds(x, y) and self.tiles[x, y] == tile_types.wall \
-               and self.cardinal_walls(x, y) > 2 - blobulousness
-
     def coords_of_tile_type(self, tile_type: tile_types.tile_dt) -> np.ndarray:
         return np.argwhere(self.tiles == tile_type)
 
+    def carve_tile(self, x: int, y: int, tile_type: tile_types.tile_dt = tile_types.floor):
+        # set a single tile, keeping the segment tracker and corridor starts (if there are any) in step
+        self.tiles[x, y] = tile_type
+        self.version += 1
+        if tile_type == tile_types.wall:
+            self.tiles_changed()
+            return
+
+        if self.segments is not None:
+            self.segments.carve(x, y)
+        if self._corridor_starts is not None:
+            # only the carved tile and its neighbors can have changed
+            for i, j in [(x, y)] + neighbor_coords(x, y):
+                if self.in_bounds(i, j):
+                    self._corridor_starts[i, j] = self.tiles[i, j] == tile_types.wall and self.cardinal_walls(i, j) == 3
+
+    def tiles_changed(self):
+        # call after writing to tiles directly. adding walls can split segments so the trackers have to go
+        self.segments = None
+        self._corridor_starts = None
+        self.version += 1
+
+    def corridor_starts(self) -> np.ndarray:
+        # mask of in bounds walls with exactly three walls next to them, where random_corridor can start digging
+        if self._corridor_starts is None:
+            walls = self.tiles == tile_types.wall
+            self._corridor_starts = np.zeros((self.width, self.height), dtype=bool, order="F")
+            self._corridor_starts[1:-1, 1:-1] = walls[1:-1, 1:-1] & (
+                walls[:-2, 1:-1].astype(np.int8) + walls[2:, 1:-1] + walls[1:-1, :-2] + walls[1:-1, 2:] == 3)
+        return self._corridor_starts
+
+    def navigation(self) -> navigation.NavigationCache:
+        # walking costs and distance maps for pathfinding, rebuilt when the tiles change
+        if self._navigation is None:
+            self._navigation = navigation.NavigationCache(self)
+        return self._navigation
+
+    def track_segments(self) -> SegmentTracker:
+        if self.segments is None:
+            self.segments = SegmentTracker(label_segments(self))
+        return self.segments
+
+    def fill_segment(self, label: int):
+        # turns a whole segment into walls. nothing else connects through it, so the tracker stays good
+        self.tiles[self.track_segments().remove(label)] = tile_types.wall
+        self._corridor_starts = None
+        self.version += 1
+
+    def tile_map(self) -> tile_types.TileMap:
+        # compact uint8 copy of the tiles for storage
+        return tile_types.TileMap.from_tiles(self.tiles)
+
 
 class Floor(Feature):
     def __init__(self, width: int, height: int, features=None):
@@ -74,6 +140,9 @@ class Floor(Feature):
         }
         self.hide_tiles()
 
+        # x, y, amount of nu piles made along with the floor, turned into entities once it's played
+        self.nu_piles: list[tuple[int, int, int]] = []
+
 
 class Pyramid(Feature):
     def __init__(self, width: int, height: int, x: int = 0, y: int = 0):
@@ -127,10 +196,10 @@ class Maze(Feature):
         self.tiles[0:self.width:self.width - 1, 0:self.height] = tile_types.wall
 
     # TODO rewooooooork
-    def add_entrances(self) -> tuple[tuple[int, int], tuple[int, int]]:
+    def add_entrances(self, rng: random.Random = random) -> tuple[tuple[int, int], tuple[int, int]]:
         wall_one_choices = []
         wall_two_choices = []
-        if random.random() < 0.5:
+        if rng.random() < 0.5:
             for y in range(1, self.height - 1):
                 if self.tiles[1, y] == tile_types.floor:
                     wall_one_choices.append((0, y))
@@ -143,8 +212,8 @@ class Maze(Feature):
                 if self.tiles[x, self.height - 2] == tile_types.floor:
                     wall_two_choices.append((x, self.height - 1))
 
-        ent_x, ent_y = random.choice(wall_one_choices)
-        ext_x, ext_y = random.choice(wall_two_choices)
+        ent_x, ent_y = rng.choice(wall_one_choices)
+        ext_x, ext_y = rng.choice(wall_two_choices)
 
         self.tiles[ent_x, ent_y] = tile_types.floor
         self.tiles[ext_x, ext_y] = tile_types.floor
@@ -153,14 +222,14 @@ class Maze(Feature):
 
 
 class PerfectMaze(Maze):
-    def __init__(self, width: int, height: int, x: int = 0, y: int = 0):
+    def __init__(self, width: int, height: int, x: int = 0, y: int = 0, rng: random.Random = random):
         super().__init__(width, height, x, y)
 
-        self.add_walls()
-        self.clean_2x2()
-        (self.ent_x, self.ent_y), (self.ext_x, self.ext_y) = self.add_entrances()
+        self.add_walls(rng)
+        self.clean_2x2(rng)
+        (self.ent_x, self.ent_y), (self.ext_x, self.ext_y) = self.add_entrances(rng)
 
-    def add_walls(self):
+    def add_walls(self, rng: random.Random = random):
         choices = []
 
         # TODO change the directions' order to up, right, down, left
@@ -171,7 +240,7 @@ class PerfectMaze(Maze):
             choices.extend([(1, y, 2), (self.width - 2, y, 4)])
 
         while choices:
-            x, y, direction = random.choice(choices)
+            x, y, direction = rng.choice(choices)
             choices.remove((x, y, direction))
             if np.count_nonzero(self.adjacent_tiles(x, y) == np.ndarray.item(tile_types.wall)) == 1 \
                     and self.tiles[x, y] == tile_types.floor \
@@ -190,14 +259,14 @@ class PerfectMaze(Maze):
             return self.tiles[x - 1, y + 1] == tile_types.floor and self.tiles[x - 1, y - 1] == tile_types.floor
 
     # any 2x2 of floor tiles should have one corner filled to make good, claustrophobic hallways
-    def clean_2x2(self):
+    def clean_2x2(self, rng: random.Random = random):
         for x in range(1, self.width - 1):
             for y in range(1, self.height - 1):
                 if all(i == tile_types.floor for i in self.tiles[x:x + 2, y:y + 2].flatten()):
-                    self.fill_corner(x, y)
+                    self.fill_corner(x, y, rng)
 
     # picks a corner to fill that won't block off the maze
-    def fill_corner(self, x: int, y: int):
+    def fill_corner(self, x: int, y: int, rng: random.Random = random):
         corners = []
         if self.tiles[x - 1, y] == tile_types.wall and self.tiles[x, y - 1] == tile_types.wall:
             corners.append((x, y))
@@ -208,21 +277,21 @@ class PerfectMaze(Maze):
         if self.tiles[x + 2, y + 1] == tile_types.wall and self.tiles[x + 1, y + 2] == tile_types.wall:
             corners.append((x + 1, y + 1))
         if corners:
-            x, y = random.choice(corners)
+            x, y = rng.choice(corners)
             self.tiles[x, y] = tile_types.wall
 
 
 # TODO BraidMazes could be loopier if we find a way to remove some 2x2s that are counting as loops
 class BraidMaze(Maze):
-    def __init__(self, width: int, height: int, x: int = 0, y: int = 0):
+    def __init__(self, width: int, height: int, x: int = 0, y: int = 0, rng: random.Random = random):
         super().__init__(width, height, x, y)
-        self.add_walls()
-        (self.ent_x, self.ent_y), (self.ext_x, self.ext_y) = self.add_entrances()
+        self.add_walls(rng)
+        (self.ent_x, self.ent_y), (self.ext_x, self.ext_y) = self.add_entrances(rng)
 
-    def add_walls(self):
+    def add_walls(self, rng: random.Random = random):
         # make a list of tuples out of all combinations of coordinates (except outer walls) and shuffle it
         floor_spaces = list(product(range(1, self.width - 1), range(1, self.height - 1)))
-        random.shuffle(floor_spaces)
+        rng.shuffle(floor_spaces)
 
         # try to add a wall at every coordinate if it will not cause any dead ends out of neighboring floor tiles
         while floor_spaces:
@@ -230,156 +299,260 @@ class BraidMaze(Maze):
             if not any(self.causes_dead_ends(i, j) for (i, j) in neighbor_coords(x, y)):
                 self.tiles[x, y] = tile_types.wall
         # connect the floor
-        connect_adjacent_segments(self)
+        connect_adjacent_segments(self, rng)
 
     def causes_dead_ends(self, x: int, y: int) -> bool:
         return self.tiles[x, y] == tile_types.floor and self.cardinal_walls(x, y) > 1
 
 
-def smooth_it_out(floor: Feature, smoothness: int = 5):
-    # converts each cell to its most common neighbor, a higher smoothness means fewer walls
+@profiler.timed('smooth')
+def smooth_it_out(floor: Feature, smoothness: int = 5, passes: int = 1) -> int:
+    # converts each cell to its most common neighbor, a higher smoothness means fewer walls. runs up to passes times
+    # and returns how many it took, stopping early once the map stops changing or flips back and forth
     bools = tiles_to_bools(floor)
-    new_floor = fast_smooth(bools, smoothness-1)
+    new_floor, passes_run = smooth_passes(bools, smoothness - 1, passes)
     bools_to_tiles(floor, new_floor)
+    return passes_run
 
 
-def fast_corr(floor: Feature, length: int):
-    # make a list of all possible starting points and shuffle it
-    wall_coords = floor.coords_of_tile_type(tile_types.wall)
-    starts = []
-    for xy in wall_coords:
-        if floor.in_bounds(xy[0], xy[1]) and floor.cardinal_walls(xy[0], xy[1]) == 3:
-            starts.append((xy[0], xy[1]))
-    random.shuffle(starts)
-
-    a = tiles_to_bools(floor)
+@profiler.timed('corridors')
+def random_corridors(floor: Feature, lengths: list[int], blobulousness: int = 0, budget: int = TUNNEL_BUDGET,
+                     rng: random.Random = random) -> int:
+    # digs a corridor for each length in order without coming back to python in between, stopping at the first one
+    # that can't be dug like the recipes' loops do. returns how many were dug
+    walls = np.asfortranarray(floor.tiles == tile_types.wall)
 
-    # try to tunnel a corridor with length-1 since x,y will be the first tile
-    while starts:
-        x, y = starts.pop()
-        if jit_corr(a, length - 1, x, y):
-            bools_to_tiles(floor, a)
-            return True
+    # the kernel keeps the feature's corridor starts up to date itself as it digs
+    xs, ys, dug = carve_corridors(walls, floor.corridor_starts(), np.asarray(lengths, dtype=np.int64),
+                                  blobulousness, budget, rng.getrandbits(32))
 
-    return False
-
-
-@njit
-def fast_smooth(a: numpy.ndarray, b):
-    new_a = numpy.zeros(shape=a.shape, dtype='b1')
-    w, h = new_a.shape
-    for x in range(1, w-1):
-        for y in range(1, h-1):
-            if np.count_nonzero(a[x-1:x+2, y-1:y+2]) > b:
-                new_a[x, y] = 1
-            else:
-                new_a[x, y] = 0
-    return new_a
+    floor.tiles[xs, ys] = tile_types.floor
+    floor.version += 1
+    if floor.segments is not None:
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            floor.segments.carve(x, y)
+    return dug
 
 
-@njit
-def jit_corr(a: numpy.ndarray, length: int, x: int, y: int):
-    # mark our tile
-    a[x, y] = 1
+@njit(cache=True, nogil=True)
+def smooth_passes(a: numpy.ndarray, b: int, passes: int):
+    # a cell becomes floor if more than b of the 3x3 around it are floor, the edges always end up as walls. repeated
+    # up to passes times with three buffers swapped between passes instead of a new array every pass.
+    # before holds the map from two passes back so a map flipping between two states can be spotted
     w, h = a.shape
-
-    # return true if we've reached target length
-    if length == 0:
-        return True
-
-    # add all neighbors to destinations, shuffle the list to build in random direction
-    dests = np.array([(x-1, y), (x+1, y), (x, y-1), (x, y+1)])
-    random.shuffle(dests)
-
-    # check all destinations and return true if they reach their conclusion, else reset the tile
-    for destx, desty in dests:
-        if 0 < x < w - 1 and 0 < y < h - 1:
-            if a[x, y] == 0:
-                if np.count_nonzero(np.array([a[x-1, y], a[x+1, y], a[x, y-1], a[x, y+1]])) == 1:
-                    if jit_corr(a, length - 1, destx, desty):
-                        return True
-                    else:
-                        a[destx, desty] = 0
-
-    # reset the starting tile if all fails and return false
-    a[x, y] = 0
-
-    return False
-
-
-def tiles_to_bools(feature: Feature) -> np.ndarray:
-    return feature.tiles['walkable']
-
-
-def bools_to_tiles(feature: Feature, a: np.ndarray):
-    for i in range(feature.width):
-        for j in range(feature.height):
-            feature.tiles[i, j] = tile_types.floor if a[i, j] else tile_types.wall
-
-
+    before, cur, nxt = np.zeros((w, h), dtype=np.bool_), a.copy(), np.zeros((w, h), dtype=np.bool_)
+    cur[0, :], cur[-1, :], cur[:, 0], cur[:, -1] = False, False, False, False
+
+    for passes_run in range(1, passes + 1):
+        changed, repeated = False, passes_run > 1
+
+        for x in range(1, w - 1):
+            for y in range(1, h - 1):
+                count = 0
+                for i in range(x - 1, x + 2):
+                    for j in range(y - 1, y + 2):
+                        count += cur[i, j]
+                nxt[x, y] = count > b
+                changed |= nxt[x, y] != cur[x, y]
+                repeated &= nxt[x, y] == before[x, y]
+
+        before, cur, nxt = cur, nxt, before
+
+        # a fixed point or a period 2 oscillation will never settle, no need to keep going. an oscillation has to
+        # stop on the half of the cycle the rest of the passes would have left it on
+        if not changed:
+            return cur, passes_run
+        if repeated:
+            return (before if (passes - passes_run) % 2 else cur), passes_run
+
+    return cur, passes
+
+
+@njit(cache=True, nogil=True)
+def window_sums(a: numpy.ndarray, r: int):
+    # counts the true cells in the (2r+1)x(2r+1) window around every cell, clipped at the edges like
+    # cells_centered_on. a summed area table makes it O(width * height) whatever the radius
+    w, h = a.shape
+    table = np.zeros((w + 1, h + 1), dtype=np.int32)
+    for x in range(w):
+        for y in range(h):
+            table[x + 1, y + 1] = int(a[x, y]) + table[x, y + 1] + table[x + 1, y] - table[x, y]
+
+    counts = np.empty((w, h), dtype=np.int32)
+    for x in range(w):
+        x1, x2 = max(x - r, 0), min(x + r + 1, w)
+        for y in range(h):
+            y1, y2 = max(y - r, 0), min(y + r + 1, h)
+            counts[x, y] = table[x2, y2] - table[x1, y2] - table[x2, y1] + table[x1, y1]
+    return counts
+
+
+@njit(cache=True, nogil=True)
+def carve_corridors(walls: numpy.ndarray, starts: numpy.ndarray, lengths: numpy.ndarray, blobulousness: int,
+                    budget: int, seed: int):
+    # random_corridor for every length in one go. walls and starts are updated as corridors are dug, and the dug
+    # tiles come back as x and y arrays along with how many corridors were made
+    np.random.seed(seed)
+    w, h = walls.shape
+    dug_x, dug_y = np.empty(lengths.sum(), dtype=np.int64), np.empty(lengths.sum(), dtype=np.int64)
+    dug_count = 0
+
+    for corridor in range(len(lengths)):
+        # shuffle the current starting points and try each until one fits a corridor of length-1 more tiles
+        start_x, start_y = np.nonzero(starts)
+        path_x, path_y = start_x[:0], start_y[:0]
+        for i in np.random.permutation(len(start_x)):
+            path_x, path_y = jit_corr(walls, lengths[corridor] - 1, start_x[i], start_y[i], blobulousness, budget)
+            if len(path_x):
+                break
+
+        if not len(path_x):
+            return dug_x[:dug_count], dug_y[:dug_count], corridor
+
+        for i in range(len(path_x)):
+            walls[path_x[i], path_y[i]] = False
+            dug_x[dug_count], dug_y[dug_count] = path_x[i], path_y[i]
+            dug_count += 1
+
+        # only the dug tiles and their neighbors can change whether they're a good start
+        for i in range(len(path_x)):
+            for dx, dy in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+                x, y = path_x[i] + dx, path_y[i] + dy
+                if 0 < x < w - 1 and 0 < y < h - 1:
+                    starts[x, y] = walls[x, y] and \
+                        walls[x - 1, y] + walls[x + 1, y] + walls[x, y - 1] + walls[x, y + 1] == 3
+
+    return dug_x[:dug_count], dug_y[:dug_count], len(lengths)
+
+
+@njit(cache=True, nogil=True)
+def jit_corr(walls: numpy.ndarray, length: int, x: int, y: int, blobulousness: int, budget: int):
+    # searches for a corridor of length more tiles after x, y: depth first with a fixed size stack instead of
+    # recursion, giving up after budget tiles tried. a wall can join the corridor if more than 2 - blobulousness of
+    # its neighbors are walls. walls is scratch and left how it was, returns the corridor's x and y coords (empty if
+    # none was found)
+    w, h = walls.shape
+    path_x, path_y = np.empty(length + 1, dtype=np.int64), np.empty(length + 1, dtype=np.int64)
+
+    # per tile on the path: the shuffled directions, how many have been tried, and the blobulousness for the next tile
+    directions = np.empty((length + 1, 4), dtype=np.int64)
+    tried = np.zeros(length + 1, dtype=np.int64)
+    blobs = np.empty(length + 1, dtype=np.int64)
+
+    path_x[0], path_y[0] = x, y
+    walls[x, y] = False
+    directions[0] = np.random.permutation(4)
+    # the last tile may loop back on to the corridor, so it's slightly less strict
+    blobs[0] = blobulousness + 1 if length == 1 else blobulousness
+    depth = 0
+
+    while 0 <= depth < length:
+        # nothing left to try from here, back up a tile
+        if tried[depth] == 4:
+            walls[path_x[depth], path_y[depth]] = True
+            depth -= 1
+            continue
+
+        direction = directions[depth, tried[depth]]
+        tried[depth] += 1
+        destx = path_x[depth] + (-1, 1, 0, 0)[direction]
+        desty = path_y[depth] + (0, 0, -1, 1)[direction]
+
+        # the destination has to be an in bounds wall with enough walls around it
+        if 0 < destx < w - 1 and 0 < desty < h - 1 and walls[destx, desty] and \
+                walls[destx - 1, desty] + walls[destx + 1, desty] + walls[destx, desty - 1] \
+                + walls[destx, desty + 1] > 2 - blobs[depth]:
+            budget -= 1
+            if budget < 0:
+                break
+
+            depth += 1
+            path_x[depth], path_y[depth] = destx, desty
+            walls[destx, desty] = False
+            directions[depth] = np.random.permutation(4)
+            tried[depth] = 0
+            blobs[depth] = blobs[depth - 1] + 1 if length - depth == 1 else blobs[depth - 1]
+
+    # put the walls back, the path is only good if it got all the way
+    for i in range(max(depth, 0) + 1):
+        walls[path_x[i], path_y[i]] = True
+    if depth == length:
+        return path_x, path_y
+    return path_x[:0], path_y[:0]
+
+
+def warm_up() -> dict[str, float]:
+    # compiles every numba kernel on a tiny map (or loads it from the on-disk cache) so the first real map doesn't
+    # stall on compiling. the argument types match the real calls so the same compiled versions get used.
+    # returns how long each kernel took
+    walls = np.ones((8, 8), dtype=bool, order="F")
+    kernels = {
+        "label_floor": (label_floor, (walls,)),
+        "window_sums": (window_sums, (walls, 1)),
+        "smooth_passes": (smooth_passes, (walls, 4, 1)),
+        "jit_corr": (jit_corr, (walls.copy(order="F"), 1, 3, 3, 0, TUNNEL_BUDGET)),
+        "carve_corridors": (carve_corridors, (walls.copy(order="F"), np.zeros_like(walls),
+                                              np.array([2], dtype=np.int64), 0, TUNNEL_BUDGET, 0)),
+    }
+
+    timings = {}
+    for name, (kernel, args) in kernels.items():
+        tick = time.perf_counter()
+        kernel(*args)
+        timings[name] = time.perf_counter() - tick
+    return timings
+
+
+def tiles_to_bools(feature: Feature, x: int = 0, y: int = 0, width: int = None, height: int = None) -> np.ndarray:
+    # copies the walkable mask of the feature (or the region starting at x, y) into a contiguous array for numba
+    width = feature.width - x if width is None else width
+    height = feature.height - y if height is None else height
+    return np.array(feature.tiles['walkable'][x:x + width, y:y + height], dtype=bool, order="F")
+
+
+def bools_to_tiles(feature: Feature, a: np.ndarray, x: int = 0, y: int = 0):
+    # writes a walkable mask back onto the feature with its top left at x, y.  only cells whose walkability changed
+    # are rewritten, so stairs and other special floors survive a round trip
+    region = feature.tiles[x:x + a.shape[0], y:y + a.shape[1]]
+    changed = region['walkable'] != a
+    carved, filled = changed & a, changed & ~a
+    region[carved] = tile_types.floor
+    region[filled] = tile_types.wall
+    if changed.any():
+        feature.version += 1
+
+    # new walls can split segments, but new floors can just be added to the tracker
+    if filled.any():
+        feature.tiles_changed()
+    elif feature.segments is not None or feature._corridor_starts is not None:
+        for i, j in np.argwhere(carved):
+            feature.carve_tile(x + i, y + j)
+
+
+@profiler.timed('fill')
 def fill_caverns(floor: Feature, radius: int = 2):
     # make wall tiles anywhere there are no other wall tiles within the given radius
-    new_floor = floor.tiles.copy(order="F")
-
-    for xy in floor.coords_of_tile_type(tile_types.floor):
-        if floor.diagonal_tile_count(xy[0], xy[1], r=radius) == 0:
-            new_floor[xy[0], xy[1]] = tile_types.wall
-
-    floor.tiles = new_floor
+    walls = floor.neighbour_counts(radius)
+    floor.tiles[(floor.tiles == tile_types.floor) & (walls == 0)] = tile_types.wall
+    floor.tiles_changed()
 
 
-def reset_map(floor: Feature, denseness: float = 0.5):
-    # randomly assigns every non-edge tile as wall or floor
-    for x in range(1, floor.width - 1):
-        for y in range(1, floor.height - 1):
-            floor.tiles[x, y] = tile_types.wall if random.random() < denseness else tile_types.floor
+@profiler.timed('reset')
+def reset_map(floor: Feature, denseness: float = 0.5, seed: int | np.random.Generator = None):
+    # randomly assigns every non-edge tile as wall or floor. the same seed always rebuilds the same map, without one
+    # the seed comes from random so seeding random is still enough to repeat a level. generators that make their own
+    # random choices take an rng instead: a random.Random of their own when a level is built from a seed (possibly
+    # off the main thread), or the random module itself by default
+    rng = np.random.default_rng(random.getrandbits(32) if seed is None else seed)
+    floors = rng.random((floor.width - 2, floor.height - 2)) >= denseness
+    floor.tiles[1:floor.width - 1, 1:floor.height - 1] = np.where(floors, tile_types.floor, tile_types.wall)
+    floor.tiles_changed()
 
 
-# TODO rework random_corridor/tunnel function with stack, currently hangs on hard-to-find tunnels
-def random_corridor(floor: Feature, length: int, blobulousness: int = 0) -> bool:
-    # make a list of all possible starting points and shuffle it
-    wall_coords = floor.coords_of_tile_type(tile_types.wall)
-    starts = []
-    for xy in wall_coords:
-        if floor.in_bounds(xy[0], xy[1]) and floor.cardinal_walls(xy[0], xy[1]) == 3:
-            starts.append((xy[0], xy[1]))
-    random.shuffle(starts)
-
-    # try to tunnel a corridor with length-1 since x,y will be the first tile
-    while starts:
-        x, y = starts.pop()
-        if tunnel(floor, length - 1, x, y, blobulousness):
-            return True
-    return False
-
-
-def tunnel(floor: Feature, length: int, x: int, y: int, blobulousness: int = 0) -> bool:
-    # mark our tile
-    floor.tiles[x, y] = tile_types.floor
-
-    # return true if we've reached target length
-    if length == 0:
-        return True
-
-    # this line makes it so a corridor will loop on to itself for the last possible tile, and be slightly less strict.
-    b = blobulousness + 1 if length == 1 else blobulousness
-
-    # add all neighbors to destinations, shuffle the list to build in random direction
-    dests = neighbor_coords(x, y)
-    random.shuffle(dests)
-
-    # check all destinations and return true if they reach their conclusion, else reset the tile
-    for destx, desty in dests:
-        if floor.can_corridor(destx, desty, b):
-            if tunnel(floor, length - 1, destx, desty, b):
-                return True
-            else:
-                floor.tiles[destx, desty] = tile_types.wall
-
-    # reset the starting tile if all fails and return false
-    floor.tiles[x, y] = tile_types.wall
-
-    return False
+def random_corridor(floor: Feature, length: int, blobulousness: int = 0, budget: int = TUNNEL_BUDGET,
+                    rng: random.Random = random) -> bool:
+    # every wall with three walls next to it can start a corridor, the numba backend tries them in a random order
+    return random_corridors(floor, [length], blobulousness, budget, rng) == 1
 
 
 # TODO make it a scan line fill so it's faster!
@@ -405,9 +578,9 @@ def flood_fill_floor(floor: Feature, x: int, y: int, ) -> (tuple[Tuple[int, int]
     return tuple(filled), tuple(boundaries)
 
 
-def corridor_between(floor: Feature, startx: int, starty: int, endx: int, endy: int):
+def corridor_between(floor: Feature, startx: int, starty: int, endx: int, endy: int, rng: random.Random = random):
     if floor.tiles[startx, starty] == tile_types.wall:
-        floor.tiles[startx, starty] = tile_types.floor
+        floor.carve_tile(startx, starty)
 
     if startx == endx and starty == endy:
         return
@@ -427,14 +600,14 @@ def corridor_between(floor: Feature, startx: int, starty: int, endx: int, endy:
     if endx > startx: choices.append(right)
     if endy < starty: choices.append(up)
     if endy > starty: choices.append(down)
-    dest = random.choice(choices)
+    dest = rng.choice(choices)
 
     if dest is up and starty > 1: starty -= 1
     if dest is right and startx < floor.width - 2: startx += 1
     if dest is down and starty < floor.height - 2: starty += 1
     if dest is left and startx > 1: startx -= 1
 
-    corridor_between(floor, startx, starty, endx, endy)
+    corridor_between(floor, startx, starty, endx, endy, rng)
 
 
 # returns the coordinates (in order) above, right, below, and left of the given coordinates
@@ -443,12 +616,13 @@ def cardinal_coords(x, y) -> list[Tuple[int, int]]:
 
 
 # TODO make different maze types available
-def make_maze(width: int, height: int, x: int, y: int) -> Maze:
+@profiler.timed('maze')
+def make_maze(width: int, height: int, x: int, y: int, rng: random.Random = random) -> Maze:
     # if either of the corners is out of bounds, don't make a maze
-    if random.random() < 0.5:
-        maze = PerfectMaze(width, height, x, y)
+    if rng.random() < 0.5:
+        maze = PerfectMaze(width, height, x, y, rng)
     else:
-        maze = BraidMaze(width, height, x, y)
+        maze = BraidMaze(width, height, x, y, rng)
 
     return maze
 
@@ -461,6 +635,7 @@ def make_new_maze_floor(floor: Feature) -> Maze:
         maze = BraidMaze(floor.width - 2, floor.height - 2, 1, 1)
 
     floor.tiles[1:floor.width - 1, 1:floor.height - 1] = maze.tiles
+    floor.tiles_changed()
     floor.hide_tiles()
 
     # add_nu_piles(floor)
@@ -468,40 +643,199 @@ def make_new_maze_floor(floor: Feature) -> Maze:
     return maze
 
 
-def floor_segments(floor: Feature) -> (set[tuple[Tuple[int, int]]], set[tuple[Tuple[int, int]]]):
-    segments = set()
-    boundaries = set()
+class Segments:
+    # connected floor segments of a feature. labels holds 0 for walls and 1..count for the segment of each floor cell
+    def __init__(self, labels: np.ndarray, count: int):
+        self.labels, self.count = labels, count
 
-    for x in range(1, floor.width - 1):
-        for y in range(1, floor.height - 1):
-            if floor.tiles[x, y] == tile_types.floor and not segments_contain(segments, x, y):
-                (floors, walls) = flood_fill_floor(floor, x, y)
-                segments.add(floors)
-                boundaries.add(walls)
-    return segments, boundaries
+        # sizes[i] is how many cells segment i has, walls aren't a segment so they're zeroed out
+        self.sizes = np.bincount(labels.ravel(), minlength=count + 1)
+        self.sizes[0] = 0
 
+        # the labels above, right, below, and left of each cell (same order as cardinal_coords), 0 off the edge
+        self.neighbours = np.zeros((4,) + labels.shape, dtype=labels.dtype)
+        self.neighbours[0, :, :-1] = labels[:, 1:]
+        self.neighbours[1, :-1, :] = labels[1:, :]
+        self.neighbours[2, :, 1:] = labels[:, :-1]
+        self.neighbours[3, 1:, :] = labels[:-1, :]
 
-def segments_contain(segments: set[tuple[Tuple[int, int]]], x: int, y: int) -> bool:
-    for segment in segments:
-        if (x, y) in segment:
-            return True
-    return False
+    def coords(self, label: int) -> np.ndarray:
+        return np.argwhere(self.labels == label)
 
+    def boundary(self, label: int) -> np.ndarray:
+        # mask of walls that touch the segment, the same walls flood_fill_floor collects
+        return (self.labels == 0) & np.any(self.neighbours == label, axis=0)
 
-# TODO there's probably a clever way to update the segments/boundaries as we go and reduce future flood fill calls
-def connect_adjacent_segments(floor: Feature) -> (set[tuple[Tuple[int, int]]], set[tuple[Tuple[int, int]]]):
-    # find the floor segments and their boundaries
-    (segments, boundaries) = floor_segments(floor)
-    boundaries = list(boundaries)
 
-    # a nested loop to compare all segment boundaries against all others
-    for i, boundary_one in enumerate(boundaries):
-        for j in range(i + 1, len(boundaries)):
-            boundary_two = boundaries[j]
-            # if there's any overlap, add pick a random tile from the overlap to make the connection
-            if set(boundary_one).intersection(set(boundary_two)):
-                (x, y) = random.choice(tuple(set(boundary_one).intersection(set(boundary_two))))
-                floor.tiles[x, y] = tile_types.floor
+@profiler.timed('labelling')
+def label_segments(floor: Feature) -> Segments:
+    # anything that isn't a wall is part of a segment, just like flood_fill_floor
+    labels, count = label_floor(np.asfortranarray(floor.tiles != tile_types.wall))
+    return Segments(labels, count)
+
+
+@njit(cache=True, nogil=True)
+def label_floor(a: numpy.ndarray):
+    # labels every connected group of true cells with its own number, one stack based flood fill per group
+    w, h = a.shape
+    labels = np.zeros((w, h), dtype=np.int32)
+
+    # cells are labelled when pushed so each one goes on the stack at most once
+    stack_x = np.empty(w * h, dtype=np.int32)
+    stack_y = np.empty(w * h, dtype=np.int32)
+    count = 0
+
+    for x in range(w):
+        for y in range(h):
+            if a[x, y] and labels[x, y] == 0:
+                count += 1
+                labels[x, y] = count
+                stack_x[0], stack_y[0] = x, y
+                top = 1
+
+                while top:
+                    top -= 1
+                    cx, cy = stack_x[top], stack_y[top]
+                    for dx, dy in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                        nx, ny = cx + dx, cy + dy
+                        if 0 <= nx < w and 0 <= ny < h and a[nx, ny] and labels[nx, ny] == 0:
+                            labels[nx, ny] = count
+                            stack_x[top], stack_y[top] = nx, ny
+                            top += 1
+
+    return labels, count
+
+
+class SegmentTracker:
+    # disjoint set over floor segments. starts from a labelling and merges segments as tiles get carved,
+    # so asking if two tiles are connected never needs another flood fill
+    def __init__(self, segments: Segments):
+        self.labels = segments.labels.copy()
+        self.parent = list(range(segments.count + 1))
+        self.sizes = segments.sizes.tolist()
+        self.count = segments.count
+
+    def find(self, label: int) -> int:
+        # path halving keeps the trees flat
+        while self.parent[label] != label:
+            self.parent[label] = self.parent[self.parent[label]]
+            label = self.parent[label]
+        return label
+
+    def union(self, one: int, two: int) -> int:
+        one, two = self.find(one), self.find(two)
+        if one == two:
+            return one
+
+        # smaller segment joins the bigger one
+        if self.sizes[one] < self.sizes[two]:
+            one, two = two, one
+        self.parent[two] = one
+        self.sizes[one] += self.sizes[two]
+        self.count -= 1
+        return one
+
+    def carve(self, x: int, y: int):
+        # a new floor tile joins every segment it touches, or starts a new one if it touches none
+        if self.labels[x, y]:
+            return
+
+        w, h = self.labels.shape
+        touching = {self.find(int(self.labels[i, j])) for (i, j) in neighbor_coords(x, y)
+                    if 0 <= i < w and 0 <= j < h and self.labels[i, j]}
+
+        if touching:
+            label = touching.pop()
+            self.sizes[label] += 1
+            for other in touching:
+                label = self.union(label, other)
+        else:
+            label = len(self.parent)
+            self.parent.append(label)
+            self.sizes.append(1)
+            self.count += 1
+
+        self.labels[x, y] = label
+
+    def remove(self, label: int) -> np.ndarray:
+        # drops a whole segment (it's being filled with walls) and returns the mask of its cells
+        mask = self.root_labels() == self.find(label)
+        self.labels[mask] = 0
+        self.sizes[self.find(label)] = 0
+        self.count -= 1
+        return mask
+
+    def segment_of(self, x: int, y: int) -> int:
+        # the segment the tile belongs to, 0 for walls
+        return self.find(int(self.labels[x, y])) if self.labels[x, y] else 0
+
+    def connected(self, x1: int, y1: int, x2: int, y2: int) -> bool:
+        return self.segment_of(x1, y1) != 0 and self.segment_of(x1, y1) == self.segment_of(x2, y2)
+
+    def roots(self) -> list[int]:
+        return [label for label in range(1, len(self.parent)) if self.find(label) == label and self.sizes[label]]
+
+    def root_labels(self) -> np.ndarray:
+        # labels array with every cell pointing at its segment's root
+        lookup = np.array([self.find(label) for label in range(len(self.parent))], dtype=self.labels.dtype)
+        return lookup[self.labels]
+
+    def coords(self, label: int) -> np.ndarray:
+        return np.argwhere(self.root_labels() == self.find(label))
+
+
+def floor_segments(floor: Feature) -> (set[tuple[Tuple[int, int]]], set[tuple[Tuple[int, int]]]):
+    # the old set of coordinate tuples interface, built from one labelling pass
+    segments = label_segments(floor)
+    floors, walls = set(), set()
+
+    for label in range(1, segments.count + 1):
+        floors.add(tuple(map(tuple, segments.coords(label).tolist())))
+        walls.add(tuple(map(tuple, np.argwhere(segments.boundary(label)).tolist())))
+    return floors, walls
+
+
+@profiler.timed('connect_segments')
+def connect_adjacent_segments(floor: Feature, rng: random.Random = random) -> dict[int, set[int]]:
+    # find the floor segments, then every wall that touches two different segments in one pass over the map
+    segments = label_segments(floor)
+    xs, ys, firsts, seconds = segment_bridges(segments)
+
+    # the labelling is done anyway, so start tracking segments from it and let the bridges update the tracker
+    floor.segments = SegmentTracker(segments)
+
+    # shuffle the bridges and keep the first one for each pair of segments, a random wall from each overlap
+    order = np.random.default_rng(rng.getrandbits(32)).permutation(len(xs))
+    pair_keys = firsts[order] * (segments.count + 1) + seconds[order]
+    _, first_of_pair = np.unique(pair_keys, return_index=True)
+    chosen = order[first_of_pair]
+    for x, y in zip(xs[chosen].tolist(), ys[chosen].tolist()):
+        floor.carve_tile(x, y)
+
+    # hand back which segments are now connected to which so callers don't need to work it out again
+    graph = {label: set() for label in range(1, segments.count + 1)}
+    for one, two in zip(firsts[chosen].tolist(), seconds[chosen].tolist()):
+        graph[one].add(two)
+        graph[two].add(one)
+    return graph
+
+
+def segment_bridges(segments: Segments) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    # x, y of every wall touching two different segments along with the two segment labels (smallest first).
+    # a wall touching three segments shows up once per pair
+    walls = segments.labels == 0
+    xs, ys, firsts, seconds = [], [], [], []
+
+    for i in range(4):
+        for j in range(i + 1, 4):
+            one, two = segments.neighbours[i], segments.neighbours[j]
+            x, y = np.nonzero(walls & (one > 0) & (two > 0) & (one != two))
+            xs.append(x)
+            ys.append(y)
+            firsts.append(np.minimum(one[x, y], two[x, y]))
+            seconds.append(np.maximum(one[x, y], two[x, y]))
+
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(firsts), np.concatenate(seconds)
 
 
 # TODO find recatngles of a certain area, also store max in case. Also width/height are swapped I think. Also find y
@@ -569,29 +903,12 @@ def max_histogram(heights: list[int]) -> Tuple[int, int, int, int]:
 
 def game_of_life_cycle(feature: Feature, live_tile: tile_types.tile_dt, dead_tile: tile_types.tile_dt):
 
-    # store a copy of the floor tiles to modify without changing adjacency counts
-    new_floor = feature.tiles.copy(order="F")
-
-    # find all instances of live_tile in the feature
-    live_tile_indices = np.argwhere(feature.tiles == live_tile)
-    check_tiles = set()
-
-    # add the coordinates of each live tile and all surrounding tiles to the set to check adjacency
-    for tile in live_tile_indices:
-        x, y = tile[0], tile[1]
-        check_tiles.update(
-            [(x-1, y-1), (x, y-1), (x+1, y-1), (x-1, y), (x, y), (x+1, y), (x-1, y+1), (x, y+1), (x+1, y+1)]
-        )
-
-    # check each tile's neighbors to see how many instances of live_tile there are
-    for x, y in check_tiles:
-        if feature.tiles[x, y] == live_tile:
-            # if there aren't 3 or 4 in the 3x3 it dies
-            if not 3 <= feature.diagonal_tile_count(x, y, tile_type=live_tile) <= 4:
-                new_floor[x, y] = dead_tile
-        elif feature.tiles[x, y] == dead_tile:
-            # if a dead tile has 3 live neighbors it changes to a live tile
-            if feature.diagonal_tile_count(x, y, tile_type=live_tile) == 3:
-                new_floor[x, y] = live_tile
-
-    feature.tiles = new_floor
+    # count every tile's live neighbors (itself included) before changing anything
+    live = feature.tiles == live_tile
+    dead = feature.tiles == dead_tile
+    neighbors = feature.neighbour_counts(tile_type=live_tile)
+
+    # live tiles without 3 or 4 in the 3x3 die, dead tiles with 3 live neighbors come alive
+    feature.tiles[live & ((neighbors < 3) | (neighbors > 4))] = dead_tile
+    feature.tiles[dead & (neighbors == 3)] = live_tile
+    feature.tiles_changed()
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+import architect
+import engine
+import tile_types
+import test_functions
+
+# level generation benchmarks, run from the repo root:
+#   python benchmarks.py                 run everything and compare against the saved baseline
+#   python benchmarks.py --save          run everything and make it the new baseline
+#   python benchmarks.py --only smooth   just the benchmarks with 'smooth' in their name
+# every run is seeded, so the same maps get built each time. exits with 1 if anything got slower than the baseline
+# by more than the tolerance
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+SIZES = {'small': (40, 30), 'medium': (68, 46), 'large': (136, 92)}
+
+
+def seeded(seed: int):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def cavern(width: int, height: int, seed: int) -> architect.Feature:
+    # a smoothed random map, what most of the benchmarks work on
+    seeded(seed)
+    feature = architect.Feature(width, height)
+    architect.reset_map(feature)
+    architect.smooth_it_out(feature, passes=3)
+    return feature
+
+
+# each benchmark sets up from a size and seed and hands back the call to time, so setup isn't part of the timing
+def bench_smooth_it_out(width, height, seed):
+    feature = architect.Feature(width, height)
+    seeded(seed)
+    architect.reset_map(feature)
+    return lambda: architect.smooth_it_out(feature, passes=10)
+
+
+def bench_fill_caverns(width, height, seed):
+    feature = cavern(width, height, seed)
+    return lambda: architect.fill_caverns(feature, 4)
+
+
+def bench_random_corridor(width, height, seed):
+    # corridors start from walls with exactly three walls next to them, a cavern has plenty (a solid map has none)
+    feature = cavern(width, height, seed)
+
+    def run():
+        dug = sum(architect.random_corridor(feature, 12) for i in range(20))
+        assert dug, "no corridors were dug, this would only be timing the wall mask"
+    return run
+
+
+def bench_floor_segments(width, height, seed):
+    feature = cavern(width, height, seed)
+    return lambda: architect.floor_segments(feature)
+
+
+def bench_connect_adjacent_segments(width, height, seed):
+    feature = cavern(width, height, seed)
+    return lambda: architect.connect_adjacent_segments(feature)
+
+
+def bench_perfect_maze(width, height, seed):
+    seeded(seed)
+    return lambda: architect.PerfectMaze(width, height)
+
+
+def bench_braid_maze(width, height, seed):
+    seeded(seed)
+    return lambda: architect.BraidMaze(width, height)
+
+
+def bench_find_rectangle(width, height, seed):
+    feature = cavern(width, height, seed)
+    return lambda: architect.find_rectangle(feature)
+
+
+def bench_game_of_life_cycle(width, height, seed):
+    feature = cavern(width, height, seed)
+
+    def run():
+        for i in range(10):
+            architect.game_of_life_cycle(feature, tile_types.floor, tile_types.wall)
+    return run
+
+
+def bench_cavern_map(width, height, seed):
+    feature = architect.Feature(width, height)
+    seeded(seed)
+    return lambda: test_functions.make_cavern_map(feature, .5, 5, 6)
+
+
+def bench_make_floor(width, height, seed):
+    # the whole floor in this process, a pool would only measure how busy the machine is
+    headless = engine.Engine()
+    seeded(seed)
+    return lambda: headless.make_floor(width, height, workers=1)
+
+
+def bench_place_player(width, height, seed):
+    headless = engine.Engine()
+    seeded(seed)
+    headless.game_map = headless.make_floor(width, height, workers=1)
+    return headless.place_player
+
+
+BENCHMARKS: dict[str, Callable] = {
+    'smooth_it_out': bench_smooth_it_out,
+    'fill_caverns': bench_fill_caverns,
+    'random_corridor': bench_random_corridor,
+    'floor_segments': bench_floor_segments,
+    'connect_adjacent_segments': bench_connect_adjacent_segments,
+    'PerfectMaze': bench_perfect_maze,
+    'BraidMaze': bench_braid_maze,
+    'find_rectangle': bench_find_rectangle,
+    'game_of_life_cycle': bench_game_of_life_cycle,
+    'make_cavern_map': bench_cavern_map,
+}
+
+# whole floors need room for four features, so they only run at the full game size
+FLOOR_BENCHMARKS: dict[str, Callable] = {
+    'Engine.make_floor': bench_make_floor,
+    'place_player': bench_place_player,
+}
+
+
+def run_benchmark(setup: Callable, width: int, height: int, repeat: int) -> list[float]:
+    # one untimed call first so kernel loading and first-use costs stay out of it, then repeat with a new seed each time
+    setup(width, height, 0)()
+    times = []
+    for seed in range(1, repeat + 1):
+        call = setup(width, height, seed)
+        tick = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - tick)
+    return times
+
+
+def run_all(only: str = None, repeat: int = 5) -> dict[str, dict]:
+    jobs = [(f"{name}[{size}]", setup, SIZES[size]) for name, setup in BENCHMARKS.items() for size in SIZES]
+    jobs += [(f"{name}[game]", setup, (engine.GAME_MAP_WIDTH, engine.GAME_MAP_HEIGHT))
+             for name, setup in FLOOR_BENCHMARKS.items()]
+
+    results = {}
+    for name, setup, (width, height) in jobs:
+        if only and only not in name:
+            continue
+        times = run_benchmark(setup, width, height, repeat)
+        results[name] = {'median': statistics.median(times), 'min': min(times), 'max': max(times), 'runs': len(times)}
+        print(f"{name:<40}{results[name]['median'] * 1000:10.3f} ms median{results[name]['min'] * 1000:10.3f} ms min")
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    # medians that are slower than the baseline's by more than tolerance (a fraction), with a millisecond of slack
+    # so the tiny benchmarks don't flag on timer noise
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median'], result['median']
+        if after > before * (1 + tolerance) + 0.001:
+            regressions.append(f"{name}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms ({after / before:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the level generators against a saved baseline.")
+    parser.add_argument('--save', action='store_true', help="save these results as the new baseline")
+    parser.add_argument('--only', default=None, help="only run benchmarks with this in their name")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 is 25%% slower")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline file to compare against or save to")
+    args = parser.parse_args()
+
+    architect.warm_up()
+    results = run_all(args.only, args.repeat)
+
+    if args.save:
+        # keep the benchmarks that weren't run this time
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                saved = json.load(file)['results']
+        saved.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(), 'results': saved},
+                      file, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save to make one")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['machine'] != platform.platform():
+        print(f"Baseline was made on {baseline['machine']}, timings from another machine may not compare")
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmarks are more than {args.tolerance:.0%} slower than the baseline:")
+        print("\n".join(regressions))
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
+import multiprocessing
 import random
-import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import numpy as np
 import tcod
 from tcod.map import compute_fov
 
 import colors
 import entity_maker
+import navigation
+import profiler
+import render_functions
 import tile_types
 import architect
 from architect import Floor, Feature
 import test_functions
 from message_log import MessageLog
 from entity_maker import Entity, Player
+from entity_store import EntityStore
 
 
 
@@ -21,28 +28,64 @@ from entity_maker import Entity, Player
 GAME_MAP_WIDTH, GAME_MAP_HEIGHT = 136, 92
 BAD_PAIRS = [{'top_left', 'bot_right'}, {'top_right', 'bot_left'}]
 
+# processes used to build a floor's four features side by side, 1 builds them one after another
+FEATURE_WORKERS = 4
+
+# how far the player can see
+FOV_RADIUS = 11
+
 
 class Engine:
-    def __init__(self, context, console: tcod.console.Console):
+    # context and console can be left out to generate floors headless, e.g. from generate.py
+    def __init__(self, context=None, console: tcod.console.Console = None):
         # make a new game map and default event handler
         self.log = MessageLog()
         self.console = console
         self.context = context
         self.game_map = Floor(GAME_MAP_WIDTH, GAME_MAP_HEIGHT)
         self.player = Player(self)
-        self.entities: list[Entity] = [self.player]
+        self.entities = EntityStore()
+        self.entities.append(self.player)
         self.depth = 1
 
+        # player turns taken, and what the console was last drawn from so frames only redraw what changed
+        self.turns = 0
+        self.render_state = render_functions.RenderState()
+
+        # what the player's fov and the transparency mask were last worked out from, see update_fov
+        self.fov_key, self.fov_visible, self.fov_window = None, None, None
+        self.transparent_key, self.transparent = None, None
+
+        # the next floor gets built on a worker thread while the current one is played
+        self.floor_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="floor builder")
+        self.next_floor: Future | None = None
+
     def update_fov(self) -> None:
-        self.game_map.visible[:] = compute_fov(
-            self.transparent_tiles(),
-            (self.player.x, self.player.y),
-            radius=11,
+        # only recomputed when the player moves, the tiles change or a bargain changes what can be seen through (or
+        # the visible array was swapped out by reveal/hide_tiles), and only over the window the radius can reach
+        game_map, x, y = self.game_map, self.player.x, self.player.y
+        key = (game_map, game_map.version, x, y, 'see_through_walls' in self.player.flags,
+               'one_eyed' in self.player.flags)
+        if key == self.fov_key and game_map.visible is self.fov_visible:
+            return
+
+        # clear what was visible last time, which is all inside the last window unless the array is new
+        if game_map.visible is self.fov_visible:
+            game_map.visible[self.fov_window] = False
+        else:
+            game_map.visible[:] = False
+
+        window = np.s_[max(x - FOV_RADIUS, 0):x + FOV_RADIUS + 1, max(y - FOV_RADIUS, 0):y + FOV_RADIUS + 1]
+        game_map.visible[window] = compute_fov(
+            self.transparent_tiles()[window],
+            (x - window[0].start, y - window[1].start),
+            radius=FOV_RADIUS,
             light_walls=True,
             algorithm=tcod.FOV_DIAMOND
         )
+        game_map.explored[window] |= game_map.visible[window]
 
-        self.game_map.explored |= self.game_map.visible
+        self.fov_key, self.fov_visible, self.fov_window = key, game_map.visible, window
 
     def calculate_viewshed(self, monster: entity_maker.Monster) -> list:
         viewshed = compute_fov(
@@ -56,8 +99,9 @@ class Engine:
         return coords
 
     def make_new_game_map(self) -> None:
-        self.entities = [self.player]
-        self.game_map = self.make_floor(self.game_map.width, self.game_map.height)
+        self.entities.clear()
+        self.entities.append(self.player)
+        self.game_map = self.take_next_floor()
         self.place_player()
         self.add_entities()
 
@@ -68,17 +112,44 @@ class Engine:
                 self.game_map.explored[xy[0], xy[1]] = True
 
         self.log.add_message("Welcome to the Crystal Caves", colors.CRYSTAL)
+        self.pregenerate_next_floor()
+
+    def pregenerate_next_floor(self) -> None:
+        # start building the floor below in the background, unless one is already on the way
+        if self.next_floor is None:
+            # the seed is drawn here so the builder thread never touches random
+            self.next_floor = self.floor_builder.submit(self.make_floor, self.game_map.width, self.game_map.height,
+                                                        seed=random.getrandbits(32))
+
+    def take_next_floor(self) -> Floor:
+        # swap in the pre-generated floor, waiting on it if it's still being built. building another one here would
+        # only queue up behind it on the feature pool. if nothing was started or building it failed, build one now
+        if self.next_floor is not None:
+            future, self.next_floor = self.next_floor, None
+            try:
+                return future.result()
+            except Exception as error:
+                print(f"Pre-generating the next floor failed, building it now: {error!r}")
+        return self.make_floor(self.game_map.width, self.game_map.height)
 
     def transparent_tiles(self) -> np.ndarray:
-        transparent = np.ones((self.game_map.width, self.game_map.height), order="F") \
-            if 'see_through_walls' in self.player.flags else self.game_map.tiles["transparent"]
-
-        if 'one_eyed' in self.player.flags:
-            new_transparent = np.zeros((self.game_map.width, self.game_map.height), order="F")
-            new_transparent[:, self.player.y] = transparent[:, self.player.y]
-            new_transparent[self.player.x, :] = transparent[self.player.x, :]
+        # cached until the tiles or the player's sight bargains change (or the player moves while one eyed). it's
+        # shared, so don't write to it
+        flags, x, y = self.player.flags, self.player.x, self.player.y
+        key = (self.game_map, self.game_map.version, 'see_through_walls' in flags, 'one_eyed' in flags and (x, y))
+        if key == self.transparent_key:
+            return self.transparent
+
+        transparent = np.ones((self.game_map.width, self.game_map.height), order="F", dtype=bool) \
+            if 'see_through_walls' in flags else self.game_map.tiles["transparent"]
+
+        if 'one_eyed' in flags:
+            new_transparent = np.zeros((self.game_map.width, self.game_map.height), order="F", dtype=bool)
+            new_transparent[:, y] = transparent[:, y]
+            new_transparent[x, :] = transparent[x, :]
             transparent = new_transparent
 
+        self.transparent_key, self.transparent = key, transparent
         return transparent
 
     def player_dead(self) -> bool:
@@ -102,8 +173,8 @@ class Engine:
             # otherwise move entity and take nu if player
             else:
                 blocked = False
-                for e in self.entities:
-                    if dest_x == e.x and dest_y == e.y and e.blocks_movement:
+                for e in self.entities.at(dest_x, dest_y):
+                    if e.blocks_movement:
                         blocked = True
                         if entity is self.player:
                             self.player.nu -= 1
@@ -113,6 +184,7 @@ class Engine:
                     # add walls if the entity has that "power"
                     if 'leave_walls' in entity.flags:
                         self.game_map.tiles[entity.x, entity.y] = tile_types.wall
+                        self.game_map.tiles_changed()
 
                     entity.x, entity.y = dest_x, dest_y
 
@@ -138,9 +210,12 @@ class Engine:
                 # insert the new wall coordinate at the beginning
                 self.player.flags['claustrophobia'][1].insert(0, (xy[0], xy[1]))
                 self.game_map.tiles[xy[0], xy[1]] = tile_types.wall
+                self.game_map.tiles_changed()
                 break
 
     def end_player_turn(self):
+        self.turns += 1
+
         # if claustrophobic randomly set a number of visible floors to walls and remove walls previously set
         if 'claustrophobia' in self.player.flags:
             coords = list(np.argwhere(self.game_map.visible))
@@ -159,43 +234,44 @@ class Engine:
                     # insert the new wall coordinate at the beginning
                     self.player.flags['claustrophobia'][1].insert(0, (xy[0], xy[1]))
                     self.game_map.tiles[xy[0], xy[1]] = tile_types.wall
+                    self.game_map.tiles_changed()
 
-        # check for collision with other entities
-        for entity in self.entities:
-            if (self.player.x, self.player.y) == (entity.x, entity.y):
-                if entity is not self.player:
-                    entity.on_collide(self.player)
+        # check for collision with other entities on the player's tile
+        for entity in self.entities.at(self.player.x, self.player.y):
+            if entity is not self.player:
+                entity.on_collide(self.player)
 
+    @profiler.timed('place_player')
     def place_player(self) -> bool:
-        floor_tiles = list(self.game_map.coords_of_tile_type(tile_types.floor))
+        # put the player on a random floor tile at least 20 steps from every down stairs, one distance map from all
+        # the stairs at once covers every candidate. tiles the stairs can't reach are never picked
+        floor_tiles = self.game_map.tiles == tile_types.floor
         down_stairs = self.game_map.coords_of_tile_type(tile_types.down_stairs)
-        random.shuffle(floor_tiles)
 
-        for xy in floor_tiles:
-            # pick a random starting tile
-            self.player.x, self.player.y = xy[0], xy[1]
-            good_location = True
+        if len(down_stairs):
+            distance = self.game_map.navigation().distances_to(down_stairs)
+            floor_tiles &= (distance >= 20) & (distance != navigation.UNREACHABLE)
 
-            # see if any stair case is closer than 20 steps to the starting tile
-            for stair_xy in down_stairs:
-                if len(self.player.path_to(stair_xy[0], stair_xy[1])) < 20:
-                    good_location = False
+        candidates = np.argwhere(floor_tiles)
+        if not len(candidates):
+            return False
 
-            # if no stair is close, return and leave the player on that tile
-            if good_location:
-                return True
-
-        return False
+        self.player.x, self.player.y = (int(i) for i in random.choice(candidates))
+        return True
 
     def reveal_stairs(self) -> None:
         for xy in self.game_map.coords_of_tile_type(tile_types.down_stairs):
             self.game_map.explored[xy[0], xy[1]] = True
 
     def entities_of_type(self, t) -> list:
-        return [monster for monster in self.entities if isinstance(monster, t)]
+        return self.entities.of_type(t)
 
     # TODO nu piles can spawn on the same tile.  is this okay??
     def add_entities(self):
+        # the big nu piles make_floor left next to maze exits
+        for x, y, amt in self.game_map.nu_piles:
+            self.entities.append(entity_maker.NuPile(self, x, y, amt))
+
         # add nu piles to every feature, more to maze features.  then move entities from features to parent floor
         for feature_name in self.game_map.features:
             feature = self.game_map.features[feature_name]
@@ -213,12 +289,15 @@ class Engine:
                     self.entities.append(entity_maker.Monster(self, feature.x + coords[0], feature.y + coords[1]))
                 num_added += 1
 
-    def make_floor(self, width: int, height: int) -> Floor:
-
+    @profiler.timed('make_floor')
+    def make_floor(self, width: int, height: int, workers: int = FEATURE_WORKERS, seed: int = None) -> Floor:
+        # make_floor runs on the floor builder thread, so it only touches the floor it's building (no entities) and
+        # draws from its own rng rather than the random the game is using. without a seed it takes one from random
+        rng = random.Random(random.getrandbits(32) if seed is None else seed)
         floor = Floor(width, height)
 
-        x_divider = random.randint(20, width - 20)
-        y_divider = random.randint(20, height - 20)
+        x_divider = rng.randint(20, width - 20)
+        y_divider = rng.randint(20, height - 20)
 
         floor.features['top_left'] = Feature(x_divider + 1, y_divider + 1, 0, 0)
         floor.features['top_right'] = Feature(width - x_divider, y_divider + 1, x_divider, 0)
@@ -229,89 +308,150 @@ class Engine:
         # 'winding'
         feature_types = ['maze', 'cavern', 'egg']
 
-        maze_feature: str = ''
-        non_mazes = []
-
-        # feature is the name of the feature: i.e. 'top_left'.  cur_feature is the value held at that key
+        # pick every feature's type and seed up front so the same floor comes out however the features get built
+        plans = {}
         for feature in floor.features:
-            feature_type = random.choice(feature_types)
-            cur_feature = floor.features[feature]
-            tick = time.perf_counter()
-
-            # dictionaries only give a view of their values or smthng
+            feature_type = rng.choice(feature_types)
             if feature_type == 'maze':
-                floor.features[feature] = architect.make_maze(cur_feature.width, cur_feature.height, cur_feature.x,
-                                                              cur_feature.y)
-                maze_feature = feature
-                self.make_maze_exit(maze=floor.features[feature], location=feature)
                 feature_types.remove('maze')
+            plans[feature] = (feature_type, rng.getrandbits(32))
 
+        maze_feature: str = ''
+        non_mazes = []
+
+        # the four features don't depend on each other, so build them all at once and wait for the lot. spans
+        # recorded in the worker processes come back with each feature
+        with profiler.span('features'):
+            built_features = build_features(floor.features, plans, workers)
+        for feature, (built, nu_piles, spans) in zip(plans, built_features):
+            floor.features[feature] = built
+            floor.nu_piles.extend(nu_piles)
+            profiler.merge(spans)
+            if plans[feature][0] == 'maze':
+                maze_feature = feature
             else:
                 non_mazes.append(feature)
 
-                if feature_type == 'winding':
-                    test_functions.make_winding_map(cur_feature)
-                elif feature_type == 'cavern':
-                    test_functions.make_cavern_map(cur_feature, .5, 5, 6)
-                elif feature_type == 'egg':
-                    test_functions.make_egg_map(cur_feature)
-                    stair_coords = random.choice(np.argwhere(cur_feature.tiles == tile_types.floor))
-                    cur_feature.tiles[stair_coords[0], stair_coords[1]] = tile_types.down_stairs
-
-            tock = time.perf_counter()
-            print(f"{feature_type} of size {cur_feature.width}x{cur_feature.height} took {tock - tick:4f} seconds.")
-
-        # set the floor tiles from its newly built features
-        for feature in floor.features.values():
-            floor.tiles[feature.x:feature.x + feature.width, feature.y:feature.y + feature.height] = feature.tiles
-
-        # connect non-maze and non-diagonal features (two times each, loop double checks pairs)
-        for feature_one in floor.features:
-            for feature_two in floor.features:
-                if feature_one == feature_two:
-                    continue
-                if {feature_one, feature_two} not in BAD_PAIRS:
-                    if feature_one is maze_feature:
-                        xy_one = [floor.features[feature_one].ent_x, floor.features[feature_one].ent_y]
-                    else:
-                        xy_one = random.choice(np.argwhere(floor.features[feature_one].tiles == tile_types.floor))
-                    x1, y1 = xy_one[0] + floor.features[feature_one].x, xy_one[1] + floor.features[feature_one].y
-                    if feature_two is maze_feature:
-                        xy_two = [floor.features[feature_two].ent_x, floor.features[feature_two].ent_y]
-                    else:
-                        xy_two = random.choice(np.argwhere(floor.features[feature_two].tiles == tile_types.floor))
-                    x2, y2 = xy_two[0] + floor.features[feature_two].x, xy_two[1] + floor.features[feature_two].y
-                    architect.corridor_between(floor, x1, y1, x2, y2)
-
-        stair_count = 2 if not maze_feature == '' else 3
-
-        for i in range(stair_count):
-            choice = random.choice(non_mazes)
-            stair_coords = random.choice(np.argwhere(floor.features[choice].tiles == tile_types.floor))
-            floor.tiles[stair_coords[0] + floor.features[choice].x, stair_coords[1] + floor.features[
-                choice].y] = tile_types.down_stairs
+        with profiler.span('connect'):
+            # set the floor tiles from its newly built features
+            for feature in floor.features.values():
+                floor.tiles[feature.x:feature.x + feature.width, feature.y:feature.y + feature.height] = feature.tiles
+
+            # connect non-maze and non-diagonal features (two times each, loop double checks pairs)
+            for feature_one in floor.features:
+                for feature_two in floor.features:
+                    if feature_one == feature_two:
+                        continue
+                    if {feature_one, feature_two} not in BAD_PAIRS:
+                        if feature_one is maze_feature:
+                            xy_one = [floor.features[feature_one].ent_x, floor.features[feature_one].ent_y]
+                        else:
+                            xy_one = rng.choice(np.argwhere(floor.features[feature_one].tiles == tile_types.floor))
+                        x1, y1 = xy_one[0] + floor.features[feature_one].x, xy_one[1] + floor.features[feature_one].y
+                        if feature_two is maze_feature:
+                            xy_two = [floor.features[feature_two].ent_x, floor.features[feature_two].ent_y]
+                        else:
+                            xy_two = rng.choice(np.argwhere(floor.features[feature_two].tiles == tile_types.floor))
+                        x2, y2 = xy_two[0] + floor.features[feature_two].x, xy_two[1] + floor.features[feature_two].y
+                        architect.corridor_between(floor, x1, y1, x2, y2, rng)
+
+        with profiler.span('stairs'):
+            stair_count = 2 if not maze_feature == '' else 3
+
+            for i in range(stair_count):
+                choice = rng.choice(non_mazes)
+                stair_coords = rng.choice(np.argwhere(floor.features[choice].tiles == tile_types.floor))
+                floor.tiles[stair_coords[0] + floor.features[choice].x, stair_coords[1] + floor.features[
+                    choice].y] = tile_types.down_stairs
+            floor.tiles_changed()
 
         return floor
 
-    def make_maze_exit(self, maze: architect.Maze, location: str):
-        x1, y1, x2, y2 = maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y
-
-        # based on location see if we need to swap entrance and exit
-        if location == 'top_left':
-            if x1 == 0 or y1 == 0:
-                maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
-        elif location == 'top_right':
-            if x1 == maze.width - 1 or y1 == 0:
-                maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
-        elif location == 'bot_left':
-            if x1 == 0 or y1 == maze.height - 1:
-                maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
-        elif location == 'bot_right':
-            if x1 == maze.width - 1 or y1 == maze.height - 1:
-                maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
-
-        # exit is a down stairs with a big nu pile next to it
-        maze.tiles[maze.ext_x, maze.ext_y] = tile_types.down_stairs
-        for x, y in architect.neighbor_coords(maze.ext_x, maze.ext_y):
-            if maze.in_bounds(x, y) and maze.tiles[x, y] == tile_types.floor:
-                self.entities.append(entity_maker.NuPile(self, maze.x + x, maze.y + y, 100))
+
+def build_features(features: dict[str, Feature], plans: dict[str, tuple[str, int]], workers: int) -> list:
+    # builds every planned feature, on the process pool when there's more than one worker. the results come back in
+    # the same order as plans
+    global _feature_pool
+    jobs = [(plans[name][0], name, features[name].width, features[name].height, features[name].x, features[name].y,
+             plans[name][1]) for name in plans]
+
+    if workers > 1:
+        try:
+            return list(feature_pool(workers).map(build_feature, *zip(*jobs)))
+        except (OSError, BrokenProcessPool) as error:
+            # no processes on this machine (or the pool died), the seeds make building here give the same floor.
+            # a dead pool is dropped so the next floor starts a new one instead of failing the same way
+            print(f"Building features without a process pool: {error}")
+            _feature_pool = None
+
+    return [build_feature(*job) for job in jobs]
+
+
+def build_feature(feature_type: str, location: str, width: int, height: int, x: int, y: int, seed: int) \
+        -> tuple[Feature, list[tuple[int, int, int]], list]:
+    # builds one quadrant of a floor from its own seed, so it can run in any process (or thread) and come out the
+    # same. returns the feature, any nu piles it wants (in floor coords) and the profiler spans recorded while
+    # building it. all of its choices come from its own rng, so building in this process leaves random alone
+    rng = random.Random(seed)
+    marker = profiler.mark()
+    nu_piles = []
+
+    if feature_type == 'maze':
+        feature = architect.make_maze(width, height, x, y, rng)
+        nu_piles = make_maze_exit(feature, location)
+    else:
+        feature = Feature(width, height, x, y)
+        if feature_type == 'winding':
+            test_functions.make_winding_map(feature, rng)
+        elif feature_type == 'cavern':
+            test_functions.make_cavern_map(feature, .5, 5, 6, rng)
+        elif feature_type == 'egg':
+            test_functions.make_egg_map(feature, rng)
+            stair_coords = rng.choice(np.argwhere(feature.tiles == tile_types.floor))
+            feature.tiles[stair_coords[0], stair_coords[1]] = tile_types.down_stairs
+
+    return feature, nu_piles, profiler.events_since(marker)
+
+
+_feature_pool: ProcessPoolExecutor | None = None
+
+
+def feature_pool(workers: int) -> ProcessPoolExecutor:
+    # one pool for the whole game, started on first use. spawn instead of fork since the game has threads (and SDL)
+    # running by the time a floor gets built. each worker loads the numba kernels as it starts
+    global _feature_pool
+    if _feature_pool is None:
+        _feature_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=architect.warm_up)
+    return _feature_pool
+
+
+def prestart_feature_pool(workers: int = FEATURE_WORKERS):
+    # spawning workers and loading numba in them takes a few seconds, so give them something to do early
+    if workers > 1:
+        pool = feature_pool(workers)
+        for i in range(workers):
+            pool.submit(int)
+
+
+def make_maze_exit(maze: architect.Maze, location: str) -> list[tuple[int, int, int]]:
+    x1, y1, x2, y2 = maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y
+
+    # based on location see if we need to swap entrance and exit
+    if location == 'top_left':
+        if x1 == 0 or y1 == 0:
+            maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
+    elif location == 'top_right':
+        if x1 == maze.width - 1 or y1 == 0:
+            maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
+    elif location == 'bot_left':
+        if x1 == 0 or y1 == maze.height - 1:
+            maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
+    elif location == 'bot_right':
+        if x1 == maze.width - 1 or y1 == maze.height - 1:
+            maze.ent_x, maze.ent_y, maze.ext_x, maze.ext_y = x2, y2, x1, y1
+
+    # exit is a down stairs with a big nu pile next to it, returned as floor x, y and amount for add_entities
+    maze.tiles[maze.ext_x, maze.ext_y] = tile_types.down_stairs
+    return [(maze.x + x, maze.y + y, 100) for x, y in architect.neighbor_coords(maze.ext_x, maze.ext_y)
+            if maze.in_bounds(x, y) and maze.tiles[x, y] == tile_types.floor]
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-import numpy as np
 import tile_types
 import colors
-from tcod import path
 from typing import Tuple, TYPE_CHECKING
+import entity_store
+from entity_store import EntityStore, StoredField
 import monster_ai
 import random
 
@@ -13,12 +13,24 @@ if TYPE_CHECKING:
 
 
 class Entity:
+    kind = entity_store.ENTITY
+
+    # kept in the engine's EntityStore arrays once the entity is added to it
+    x, y = StoredField('x'), StoredField('y')
+    graphic = StoredField('graphic')
+    blocks_movement = StoredField('blocks')
+    nu = StoredField('nu')
+    energy = StoredField('energy')
+
     def __init__(self, parent: Engine, x: int = None, y: int = None, graphic: tile_types.graphic_dt = None):
+        self.store: EntityStore | None = None
+        self.id = -1
         self.parent = parent
         self.x, self.y = x, y
         self.graphic = graphic
         self.blocks_movement = False
         self.nu = None
+        self.energy = 0
         self.flags = {}
 
     def on_collide(self, collider: Entity):
@@ -35,18 +47,8 @@ class Actor(Entity):
     # TODO will bump enemies and then teleport to the next step
     # noinspection PyTypeChecker
     def path_to(self, dest_x, dest_y) -> list[Tuple[int, int]]:
-        cost = np.array(self.parent.game_map.tiles["walkable"], dtype=np.int8)
-
-        graph = path.SimpleGraph(cost=cost, cardinal=1, diagonal=0)
-        pathfinder = path.Pathfinder(graph)
-
-        pathfinder.add_root((self.x, self.y))  # starting position
-
-        # compute path and remove starting point
-        steps: list[list[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
-
-        # convert from List of lists to list of Tuples
-        return [(index[0], index[1]) for index in steps]
+        # steps to the destination (without the starting point) from the floor's shared distance maps
+        return self.parent.game_map.navigation().path(self.x, self.y, dest_x, dest_y)
 
     def on_collide(self, collider: Entity):
         raise NotImplementedError
@@ -56,6 +58,8 @@ class Actor(Entity):
 
 
 class Player(Actor):
+    kind = entity_store.PLAYER
+
     def __init__(self, parent: Engine, x: int = None, y: int = None, nu: int = 300):
         super().__init__(parent, (64, colors.ORANGE, colors.DARK_GREY), x, y, nu)
 
@@ -67,6 +71,8 @@ class Player(Actor):
 
 
 class Monster(Actor):
+    kind = entity_store.MONSTER
+
     def __init__(self, parent: Engine, x: int, y: int):
         super().__init__(parent, (2, colors.LIGHT_GREEN, colors.DARK_GREY), x, y, 10)
         self.target_tiles = []
@@ -95,6 +101,8 @@ class Monster(Actor):
 
 
 class NuPile(Entity):
+    kind = entity_store.NU_PILE
+
     def __init__(self, parent: Engine, x: int, y: int, amt: int):
         super().__init__(parent, x, y, (15, colors.GOLD, colors.DARK_GREY))
         self.amt = amt
@@ -103,3 +111,6 @@ class NuPile(Entity):
         if type(collider) is Player:
             collider.nu += self.amt
             self.parent.entities.remove(self)
+
+
+entity_store.KINDS.update({Entity.kind: Entity, Player.kind: Player, Monster.kind: Monster, NuPile.kind: NuPile})
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from typing import Iterator, TYPE_CHECKING
+
+import numpy as np
+
+import tile_types
+
+if TYPE_CHECKING:
+    from entity_maker import Entity
+
+# what kind of entity each id holds, entity classes set theirs as a class attribute
+ENTITY, PLAYER, MONSTER, NU_PILE = 0, 1, 2, 3
+
+# x and y of entities that aren't on the map yet (the player before place_player)
+NOWHERE = -1
+
+
+class StoredField:
+    # an entity attribute that lives in its store's array once it's been added to one, and on the entity before that
+    # (or after it's removed). an x or y of None is kept as NOWHERE in the arrays
+    def __init__(self, array: str):
+        self.array = array
+
+    def __set_name__(self, owner, name: str):
+        self.private = '_' + name
+
+    def __get__(self, entity: Entity, owner=None):
+        if entity is None:
+            return self
+        if entity.store is None:
+            return entity.__dict__[self.private]
+        value = getattr(entity.store, self.array)[entity.id]
+        if self.array in ('x', 'y'):
+            return None if value == NOWHERE else int(value)
+        return value if self.array == 'graphic' else value.item()
+
+    def __set__(self, entity: Entity, value):
+        if entity.store is None:
+            entity.__dict__[self.private] = value
+        elif self.array == 'x':
+            entity.store.move(entity.id, value, entity.y)
+        elif self.array == 'y':
+            entity.store.move(entity.id, entity.x, value)
+        else:
+            getattr(entity.store, self.array)[entity.id] = 0 if value is None else value
+
+
+class EntityStore:
+    # every entity on the floor as parallel arrays indexed by entity id, plus a hash of which ids are on each cell so
+    # collision checks don't scan every entity. ids of removed entities get reused. iterates (and appends and removes)
+    # like the list of entities it replaces
+    def __init__(self, capacity: int = 256):
+        self.x = np.full(capacity, NOWHERE, dtype=np.int32)
+        self.y = np.full(capacity, NOWHERE, dtype=np.int32)
+        self.kind = np.zeros(capacity, dtype=np.uint8)
+        self.nu = np.zeros(capacity, dtype=np.int32)
+        self.energy = np.zeros(capacity, dtype=np.int32)
+        self.blocks = np.zeros(capacity, dtype=bool)
+        self.graphic = np.zeros(capacity, dtype=tile_types.graphic_dt)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+        self.objects: list[Entity | None] = [None] * capacity
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        self.free: list[int] = []
+        self.count = 0
+
+    def __len__(self) -> int:
+        return int(self.alive.sum())
+
+    def __iter__(self) -> Iterator[Entity]:
+        # a snapshot, so entities can be added or removed while looping
+        return iter([self.objects[i] for i in self.ids()])
+
+    def __contains__(self, entity: Entity) -> bool:
+        return entity.store is self
+
+    def ids(self) -> np.ndarray:
+        return np.flatnonzero(self.alive[:self.count])
+
+    def grow(self):
+        capacity = len(self.alive) * 2
+        for name in ('x', 'y', 'kind', 'nu', 'energy', 'blocks', 'graphic', 'alive'):
+            old = getattr(self, name)
+            new = np.full(capacity, NOWHERE, dtype=old.dtype) if name in ('x', 'y') else np.zeros(capacity, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.objects.extend([None] * (capacity - len(self.objects)))
+
+    def append(self, entity: Entity):
+        if entity.store is not None:
+            entity.store.remove(entity)
+        if self.free:
+            i = self.free.pop()
+        else:
+            if self.count == len(self.alive):
+                self.grow()
+            i = self.count
+            self.count += 1
+
+        # move the entity's own values into the arrays, the properties read and write them from here on
+        values = {name: entity.__dict__.pop('_' + name) for name in ('x', 'y', 'nu', 'energy', 'blocks_movement',
+                                                                     'graphic')}
+        self.x[i] = NOWHERE if values['x'] is None else values['x']
+        self.y[i] = NOWHERE if values['y'] is None else values['y']
+        self.nu[i] = values['nu'] or 0
+        self.energy[i] = values['energy']
+        self.blocks[i] = values['blocks_movement']
+        if values['graphic'] is not None:
+            self.graphic[i] = values['graphic']
+        self.kind[i] = entity.kind
+        self.alive[i] = True
+        self.objects[i] = entity
+        entity.store, entity.id = self, i
+        self.cells.setdefault((int(self.x[i]), int(self.y[i])), []).append(i)
+
+    def remove(self, entity: Entity):
+        # hands the entity its values back, it can still be looked at (e.g. where a monster died) once it's gone
+        i = entity.id
+        for name in ('x', 'y', 'nu', 'energy', 'blocks_movement', 'graphic'):
+            value = getattr(entity, name)
+            entity.__dict__['_' + name] = value.copy() if name == 'graphic' else value
+        self.cells[(int(self.x[i]), int(self.y[i]))].remove(i)
+
+        self.alive[i] = False
+        self.objects[i] = None
+        self.x[i], self.y[i] = NOWHERE, NOWHERE
+        self.free.append(i)
+        entity.store, entity.id = None, -1
+
+    def clear(self):
+        for entity in list(self):
+            self.remove(entity)
+
+    def move(self, i: int, x: int | None, y: int | None):
+        x = NOWHERE if x is None else x
+        y = NOWHERE if y is None else y
+        self.cells[(int(self.x[i]), int(self.y[i]))].remove(i)
+        self.x[i], self.y[i] = x, y
+        self.cells.setdefault((int(x), int(y)), []).append(i)
+
+    def at(self, x: int, y: int) -> list[Entity]:
+        # everything on the cell, in the order it got there
+        return [self.objects[i] for i in self.cells.get((x, y), [])]
+
+    def blocking_at(self, x: int, y: int) -> Entity | None:
+        for i in self.cells.get((x, y), []):
+            if self.blocks[i]:
+                return self.objects[i]
+        return None
+
+    def ids_of_type(self, t: type) -> np.ndarray:
+        # ids of live entities that are instances of t, worked out from the kinds of the classes in the store
+        kinds = [kind for kind, cls in KINDS.items() if issubclass(cls, t)]
+        ids = self.ids()
+        return ids[np.isin(self.kind[ids], kinds)]
+
+    def of_type(self, t: type) -> list[Entity]:
+        return [self.objects[i] for i in self.ids_of_type(t)]
+
+
+# entity class of each kind, filled in by entity_maker as it defines them
+KINDS: dict[int, type] = {}
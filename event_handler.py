@@ -11,13 +11,12 @@ import tcod.console
 import tcod.event
 import numpy as np
 import os
-from operator import attrgetter
 
 import tile_types
 from test_functions import make_egg_map, make_cavern_map, make_winding_map
 from god_bargains import see_through_walls, one_eyed, see_stairs, teleportitis, leave_walls, claustrophobia
 from engine import Engine
-from main import WIDTH, HEIGHT, MAP_Y_OFFSET
+from settings import WIDTH, HEIGHT, MAP_Y_OFFSET
 
 MOVE_KEYS = {
     # arrow keys
@@ -62,6 +61,9 @@ ActionOrHandler = Union[actions.Action, "BaseEventHandler"]
 
 
 class BaseEventHandler(tcod.event.EventDispatch[None]):
+    # handlers whose on_render checks engine.render_state and only redraws regions that changed
+    tracks_regions = False
+
     # Main handler, has a log and engine (for console/context)
     def __init__(self, eng: Engine):
         self.engine = eng
@@ -94,7 +96,7 @@ class MainMenuHandler(BaseEventHandler):
     #  handlers' on_render will call appropriate functions from render_functions
     def on_render(self) -> None:
         self.engine.console.clear()
-        render_functions.render_main_menu(self.engine)
+        render_functions.render_main_menu(self.engine.console)
 
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[ActionOrHandler]:
         if event.sym in (tcod.event.K_q, tcod.event.K_ESCAPE):
@@ -118,17 +120,23 @@ class MainMenuHandler(BaseEventHandler):
 
 
 class MapBuildingHandler(BaseEventHandler):
+    tracks_regions = True
+
     def __init__(self, eng: Engine):
         super().__init__(eng)
         self.x1, self.y1, self.x2, self.y2 = None, None, None, None
 
     def on_render(self):
-        self.engine.console.clear()
-        render_functions.render_main_screen_map(self.engine)
-        render_functions.render_entities_map(self.engine)
-        render_functions.render_ui_map_builder(self.engine)
-        if self.x2:
-            render_functions.render_selected_tiles(self.engine, self.x1, self.y1, self.x2, self.y2)
+        engine, state = self.engine, self.engine.render_state
+        if state.changed('map', (engine.game_map, engine.game_map.version, len(engine.entities), engine.player.x,
+                                 engine.player.y, self.x1, self.y1, self.x2, self.y2)):
+            render_functions.render_main_screen_map(engine)
+            render_functions.render_entities_map(engine)
+            if self.x2:
+                render_functions.render_selected_tiles(engine, self.x1, self.y1, self.x2, self.y2)
+
+        if state.changed('bar', (engine.log.messages[-1].full_text if engine.log.messages else None,)):
+            render_functions.render_ui_map_builder(engine)
 
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[ActionOrHandler]:
         key = event.sym
@@ -155,6 +163,7 @@ class MapBuildingHandler(BaseEventHandler):
 
             self.engine.console = tcod.console.Console(WIDTH, HEIGHT + MAP_Y_OFFSET, order='F')
             self.engine.log.add_message("Welcome to the Crystal Caves", colors.CRYSTAL)
+            self.engine.pregenerate_next_floor()
             return PlayerMoverHandler(self.engine)
 
         elif key == tcod.event.K_g:
@@ -173,7 +182,7 @@ class MapBuildingHandler(BaseEventHandler):
             architect.connect_adjacent_segments(self.engine.game_map)
 
         elif key == tcod.event.K_j:
-            architect.fast_corr(self.engine.game_map, 20)
+            architect.random_corridor(self.engine.game_map, 20)
 
         # checks if the key pressed matches a command's hotkey, and performs it if so
         for act in actions.ACTIONS.values():
@@ -226,6 +235,7 @@ class MapBuildingHandler(BaseEventHandler):
             w, h = settings.SETTINGS["Maze (W)idth"].val, settings.SETTINGS["Maze (H)eight"].val
             if self.engine.game_map.in_bounds(x + w, y + h):
                 self.engine.game_map.tiles[x: x + w, y:y + h] = architect.make_maze(w, h, x, y).tiles
+                self.engine.game_map.tiles_changed()
 
 
 class SettingsHandler(BaseEventHandler):
@@ -322,6 +332,8 @@ class GodBargainHandler(BaseEventHandler):
 
 
 class PlayerMoverHandler(BaseEventHandler):
+    tracks_regions = True
+
     def ev_keydown(self, event: tcod.event.KeyDown) -> "BaseEventHandler":
         key = event.sym
 
@@ -354,8 +366,10 @@ class PlayerMoverHandler(BaseEventHandler):
 
         elif key == tcod.event.K_s:
             self.engine.game_map.reveal_tiles()
+            self.engine.render_state.invalidate()
         elif key == tcod.event.K_h:
             self.engine.game_map.hide_tiles()
+            self.engine.render_state.invalidate()
 
         elif key == tcod.event.K_ESCAPE:
             raise SystemExit()
@@ -366,11 +380,16 @@ class PlayerMoverHandler(BaseEventHandler):
         return self
 
     def on_render(self):
-        self.engine.console.clear()
+        engine, state, player = self.engine, self.engine.render_state, self.engine.player
+
+        # the map (and fov) only change when the player or a monster moves, the tiles change or a bargain is made
+        if state.changed('map', (engine.game_map, engine.game_map.version, engine.turns, player.x, player.y,
+                                 tuple(player.flags))):
+            engine.update_fov()
+            render_functions.render_main_screen_player(engine)
 
-        self.engine.update_fov()
-        render_functions.render_main_screen_player(self.engine)
-        render_functions.render_bottom_bar_player(self.engine)
+        if state.changed('bar', (player.nu, engine.log.messages[-1].full_text if engine.log.messages else None)):
+            render_functions.render_bottom_bar_player(engine)
 
 
 class GameInstructionsHandler(BaseEventHandler):
@@ -412,12 +431,14 @@ class WinHandler(BaseEventHandler):
 
 
 def tick(handler: BaseEventHandler):
-    actors = handler.engine.entities_of_type(entity_maker.Actor)
-    min_actor = min(actors, key=attrgetter('energy'))
-    min_actor_energy = min_actor.energy
-    for actor in actors:
-        actor.energy = max(0, actor.energy - min_actor_energy)
-    return PlayerMoverHandler(handler.engine) if handler.engine.player.energy == 0 else monster_turn(handler, min_actor)
+    # the actor with the least energy goes next, everyone's energy drops by that much so it's at 0
+    entities = handler.engine.entities
+    actors = entities.ids_of_type(entity_maker.Actor)
+    min_actor = actors[np.argmin(entities.energy[actors])]
+    entities.energy[actors] -= entities.energy[min_actor]
+    if handler.engine.player.energy == 0:
+        return PlayerMoverHandler(handler.engine)
+    return monster_turn(handler, entities.objects[min_actor])
 
 
 def monster_turn(handler: BaseEventHandler, monster: entity_maker.Monster):
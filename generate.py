@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import architect
+import engine
+import profiler
+import tile_types
+
+# headless level generation, no window needed:
+#   python generate.py floor 100 --workers 8 --seed 1
+#   python generate.py cavern 500 --width 68 --height 46 --out resources/caverns
+# every level is saved as a compressed .npz of tile palette ids (see tile_types.TileMap) along with its seed, and the
+# profiler's spans from every worker are gathered into the stage report (and a chrome trace with --trace)
+
+RECIPES = ['floor', 'maze', 'cavern', 'egg', 'winding']
+
+
+# one engine per process to build whole floors with, make_floor doesn't use any of its game state
+_engine: engine.Engine | None = None
+
+
+def generate(recipe: str, width: int, height: int, seed: int) -> tuple[np.ndarray, list, int, int]:
+    # builds one level from its seed. returns its tile ids, the profiler spans recorded, floor segments and down stairs
+    global _engine
+    marker = profiler.mark()
+    with profiler.span('level'):
+        if recipe == 'floor':
+            if _engine is None:
+                _engine = engine.Engine()
+            level = _engine.make_floor(width, height, workers=1, seed=seed)
+        else:
+            level, nu_piles, spans = engine.build_feature(recipe, 'top_left', width, height, 0, 0, seed)
+
+    segments = architect.label_segments(level).count
+    stairs = len(level.coords_of_tile_type(tile_types.down_stairs))
+    return level.tile_map().ids, profiler.events_since(marker), segments, stairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate levels without opening a window.")
+    parser.add_argument('recipe', choices=RECIPES, help="whole floors or a single feature type")
+    parser.add_argument('count', type=int, help="how many levels to make")
+    parser.add_argument('--width', type=int, default=engine.GAME_MAP_WIDTH)
+    parser.add_argument('--height', type=int, default=engine.GAME_MAP_HEIGHT)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes to generate with")
+    parser.add_argument('--seed', type=int, default=None, help="seed for the whole batch, random if not given")
+    parser.add_argument('--out', default='resources/generated', help="directory to save the levels in")
+    parser.add_argument('--trace', default=None, help="also save a chrome trace of every stage to this file")
+    args = parser.parse_args()
+
+    # every level gets its own seed from the batch seed, so any one of them can be rebuilt on its own
+    batch_random = random.Random(args.seed)
+    seeds = [batch_random.getrandbits(32) for i in range(args.count)]
+    os.makedirs(args.out, exist_ok=True)
+
+    # the workers pick this up as they start
+    profiler.enable()
+    disconnected, no_stairs = 0, 0
+
+    tick = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1), initializer=architect.warm_up) as pool:
+        results = pool.map(generate, [args.recipe] * args.count, [args.width] * args.count,
+                           [args.height] * args.count, seeds)
+
+        for i, (seed, (ids, spans, segments, stairs)) in enumerate(zip(seeds, results)):
+            np.savez_compressed(os.path.join(args.out, f"{args.recipe}_{i:05d}"), tiles=ids, seed=seed)
+
+            profiler.merge(spans)
+            disconnected += segments > 1
+            no_stairs += args.recipe == 'floor' and stairs == 0
+    tock = time.perf_counter()
+
+    print(f"Made {args.count} {args.recipe} levels of {args.width}x{args.height} in {tock - tick:.2f} seconds "
+          f"({args.count / (tock - tick):.2f} levels/second) with {args.workers} workers, saved to {args.out}")
+    print(f"{disconnected} had more than one floor segment, {no_stairs} had no stairs")
+    print(profiler.report())
+    if args.trace:
+        profiler.export_chrome_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
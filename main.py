@@ -1,14 +1,15 @@
-import event_handler
+import atexit
+import profiler
+import startup
+import render_functions
 import tcod
 import os
-from engine import Engine
+import time
+from settings import WIDTH, HEIGHT, MAP_Y_OFFSET, TARGET_FPS
 
 # copy-pasted bitwise magic, lets me resize the window
 FLAGS = tcod.context.SDL_WINDOW_RESIZABLE | tcod.context.SDL_WINDOW_MAXIMIZED
 
-# TODO There's an error when one of these two/2 returns an odd value, needs a rework
-WIDTH, HEIGHT, MAP_Y_OFFSET = 68, 52, 3
-
 
 def main() -> None:
     if not os.path.exists('./resources'):
@@ -16,6 +17,14 @@ def main() -> None:
         os.makedirs('./resources')
         os.makedirs('./resources/features')
 
+    # with DUNGEON_PROFILE=1 the map generation spans get saved when the game closes
+    if profiler.enabled:
+        atexit.register(profiler.export_json, './resources/profile.json')
+        atexit.register(profiler.export_chrome_trace, './resources/profile_trace.json')
+
+    # load numba, the map generators and the game while the window opens, the menu only needs tcod
+    startup.preload()
+
     tileset = tcod.tileset.load_tilesheet("Anno_16x16.png", 16, 16, tcod.tileset.CHARMAP_CP437)
     console = tcod.Console(WIDTH, HEIGHT+MAP_Y_OFFSET, order="F")
 
@@ -32,19 +41,53 @@ def main() -> None:
             sdl_window_flags=FLAGS
     ) as context:
 
+        # show the menu straight away, then wait for the generation stack to finish loading behind it. events keep
+        # getting pumped meanwhile so the window can be closed, moved or resized
+        render_functions.render_main_menu(console)
+        context.present(console)
+        startup.mark("first menu frame")
+
+        while startup.loading():
+            events = list(tcod.event.wait(timeout=0.1))
+            if any(isinstance(event, tcod.event.Quit) for event in events):
+                raise SystemExit()
+            if events:
+                context.present(console)
+        startup.wait()
+        import event_handler
+        from engine import Engine
+        startup.mark("generation stack ready")
+        print(startup.report())
+
         engine = Engine(context, console)
         handler = event_handler.MainMenuHandler(engine)
 
-        # TODO make a good main loop (implement some delay system for rendering?)
-        while True:
+        # frame times get printed when the game closes
+        frame_stats = profiler.FrameStats()
+        atexit.register(lambda: print(frame_stats.report()))
+        frame_time = 1 / TARGET_FPS
 
-            for event in tcod.event.wait():
+        while True:
+            # sleep until something happens, then handle everything that's queued up as one frame. drawing comes
+            # after so the frame shows the result of all of it
+            events = list(tcod.event.wait())
+            frame_start = time.perf_counter()
+            for event in events:
                 context.convert_event(event)
-                if isinstance(handler, event_handler.BaseEventHandler):
-                    handler.on_render()
-                    context.present(handler.engine.console)
                 handler = handler.handle_events(event)
-
+                engine.render_state.event_handled(event)
+            rendering = time.perf_counter()
+
+            # at most one render and present a frame, and only if something on screen could have changed
+            if render_functions.render_frame(handler):
+                presenting = time.perf_counter()
+                context.present(engine.console)
+                frame_end = time.perf_counter()
+                frame_stats.add(rendering - frame_start, presenting - rendering, frame_end - presenting)
+
+                # hold off the next frame so held keys can't draw faster than the target rate
+                if frame_end - frame_start < frame_time:
+                    time.sleep(frame_time - (frame_end - frame_start))
 
 
 if __name__ == "__main__":
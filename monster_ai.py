@@ -57,13 +57,13 @@ def move_to_target(monster: Monster):
             monster.viewshed = monster.parent.calculate_viewshed(monster)
             return
 
-        for entity in monster.parent.entities:
-            if x == entity.x and y == entity.y and entity.blocks_movement:
-                monster.parent.log.add_message(random.choice(words) + ' (-5 nu)')
-                entity.on_collide(monster)
-                monster.target_tiles = []
-                monster.viewshed = monster.parent.calculate_viewshed(monster)
-                return
+        entity = monster.parent.entities.blocking_at(x, y)
+        if entity is not None:
+            monster.parent.log.add_message(random.choice(words) + ' (-5 nu)')
+            entity.on_collide(monster)
+            monster.target_tiles = []
+            monster.viewshed = monster.parent.calculate_viewshed(monster)
+            return
 
         monster.x, monster.y = x, y
 
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import collections
+from typing import Iterable, Tuple, TYPE_CHECKING
+
+import numpy as np
+import tcod.path
+
+if TYPE_CHECKING:
+    from architect import Feature
+
+# how many distance maps a floor keeps around, the player and the stairs are the usual targets so it stays small
+MAX_DISTANCE_MAPS = 16
+
+UNREACHABLE = np.iinfo(np.int32).max
+
+
+class NavigationCache:
+    # walking costs and distance maps toward targets for one feature, built on first use and thrown away whenever
+    # the feature's version changes (any tiles_changed or carve_tile)
+    def __init__(self, feature: Feature):
+        self.feature = feature
+        self.version = -1
+        self.cost: np.ndarray | None = None
+        self.distance_maps: collections.OrderedDict[tuple, np.ndarray] = collections.OrderedDict()
+
+    def refresh(self):
+        if self.version != self.feature.version:
+            self.cost = np.asfortranarray(self.feature.tiles["walkable"], dtype=np.int8)
+            self.distance_maps.clear()
+            self.version = self.feature.version
+
+    def distances_to(self, targets: Iterable[Tuple[int, int]]) -> np.ndarray:
+        # steps from every tile to the closest of the targets, UNREACHABLE where none can be reached. the array is
+        # shared with other callers, so don't write to it
+        self.refresh()
+        key = tuple(sorted((int(x), int(y)) for x, y in targets))
+        if key in self.distance_maps:
+            self.distance_maps.move_to_end(key)
+            return self.distance_maps[key]
+
+        distance = tcod.path.maxarray(self.cost.shape, dtype=np.int32, order="F")
+        for x, y in key:
+            distance[x, y] = 0
+        tcod.path.dijkstra2d(distance, self.cost, cardinal=1, diagonal=0, out=distance)
+        distance.flags.writeable = False
+
+        self.distance_maps[key] = distance
+        if len(self.distance_maps) > MAX_DISTANCE_MAPS:
+            self.distance_maps.popitem(last=False)
+        return distance
+
+    def path(self, start_x: int, start_y: int, dest_x: int, dest_y: int) -> list[Tuple[int, int]]:
+        # steps from start to dest, not including start. empty if dest can't be reached (or is start)
+        distance = self.distances_to([(dest_x, dest_y)])
+        if distance[start_x, start_y] == UNREACHABLE:
+            return []
+        steps = tcod.path.hillclimb2d(distance, (start_x, start_y), cardinal=True, diagonal=False)[1:]
+        return [(x, y) for x, y in steps.tolist()]
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+# named timing spans for map generation (reset, smooth, corridors, labelling, connect, fill, stairs, ...)
+#   with profiler.span('connect'):
+#       ...
+#   @profiler.timed('smooth')
+#   def smooth_it_out(...)
+# spans cost one flag check while profiling is off, so they stay in the code. turn it on with DUNGEON_PROFILE=1 or
+# profiler.enable(), then read profiler.report() or save with export_json / export_chrome_trace
+
+ENV_FLAG = "DUNGEON_PROFILE"
+
+# only this many of the most recent spans are kept for traces, histograms keep counting past it
+MAX_EVENTS = 100_000
+
+enabled = os.environ.get(ENV_FLAG, "0") not in ("", "0")
+
+# (name, start ns, duration ns, pid, thread id). start is perf_counter_ns, which every process on the machine shares
+events: collections.deque[tuple[str, int, int, int, int]] = collections.deque(maxlen=MAX_EVENTS)
+histograms: dict[str, Histogram] = {}
+recorded = 0
+
+_lock = threading.Lock()
+_disabled_span = contextlib.nullcontext()
+
+
+class Histogram:
+    # durations bucketed by powers of two (in microseconds), so it stays small however many spans get recorded
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets: dict[int, int] = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        bucket = max(int(seconds * 1_000_000), 1).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        # upper edge of the bucket the percentile falls in, clamped to the slowest span seen
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= self.count * p / 100:
+                return min((1 << bucket) / 1_000_000, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total": self.total, "mean": self.mean, "min": self.min, "max": self.max,
+                "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+                "buckets_us": {1 << bucket: count for bucket, count in sorted(self.buckets.items())}}
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class FrameStats:
+    # the last few seconds of frames, split into logic (handling events), render and present. always on, unlike
+    # spans, since it's a handful of appends per frame
+    STAGES = ("logic", "render", "present")
+
+    def __init__(self, frames: int = 600):
+        self.samples = {stage: collections.deque(maxlen=frames) for stage in self.STAGES}
+        self.frames = 0
+
+    def add(self, logic: float, render: float, present: float):
+        self.frames += 1
+        for stage, seconds in zip(self.STAGES, (logic, render, present)):
+            self.samples[stage].append(seconds)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        # exact percentiles over the window, it's small enough to sort
+        stats = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            stats[stage] = {"mean": sum(ordered) / len(ordered),
+                            "p95": ordered[min(int(len(ordered) * .95), len(ordered) - 1)],
+                            "p99": ordered[min(int(len(ordered) * .99), len(ordered) - 1)],
+                            "max": ordered[-1]}
+        return stats
+
+    def report(self) -> str:
+        lines = [f"{'frames: ' + str(self.frames):<20}{'mean ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for stage, stats in self.summary().items():
+            lines.append(f"{stage:<20}{stats['mean'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+                         f"{stats['p99'] * 1000:>10.2f}{stats['max'] * 1000:>10.2f}")
+        return "\n".join(lines)
+
+
+def enable(on: bool = True):
+    # also set in the environment so processes started from here on (e.g. the feature pool) profile too
+    global enabled
+    enabled = on
+    os.environ[ENV_FLAG] = "1" if on else "0"
+
+
+def span(name: str):
+    # times the with block under name, or does nothing at all when profiling is off
+    if not enabled:
+        return _disabled_span
+    return _Span(name)
+
+
+def timed(name: str = None):
+    # decorator version of span, named after the function if no name is given
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name: str, start: int, duration: int, pid: int = None, tid: int = None):
+    global recorded
+    with _lock:
+        recorded += 1
+        events.append((name, start, duration, pid or os.getpid(), tid or threading.get_ident()))
+        if name not in histograms:
+            histograms[name] = Histogram()
+        histograms[name].add(duration / 1e9)
+
+
+def mark() -> int:
+    # how many spans have been recorded, pass it to events_since to get the spans recorded after this point
+    return recorded
+
+
+def events_since(marker: int) -> list[tuple[str, int, int, int, int]]:
+    with _lock:
+        count = min(recorded - marker, len(events))
+        return list(events)[len(events) - count:] if count > 0 else []
+
+
+def merge(worker_events: list[tuple[str, int, int, int, int]]):
+    # add spans recorded in another process. ones from this process are already here (the work ran in process)
+    pid = os.getpid()
+    for name, start, duration, event_pid, tid in worker_events:
+        if event_pid != pid:
+            record(name, start, duration, event_pid, tid)
+
+
+def reset():
+    global recorded
+    with _lock:
+        recorded = 0
+        events.clear()
+        histograms.clear()
+
+
+def summary() -> dict[str, dict]:
+    with _lock:
+        return {name: histogram.to_dict() for name, histogram in histograms.items()}
+
+
+def report() -> str:
+    # one line per span name, most total time first
+    lines = [f"{'span':<20}{'count':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for name, stats in sorted(summary().items(), key=lambda item: item[1]["total"], reverse=True):
+        lines.append(f"{name:<20}{stats['count']:>8}{stats['total']:>10.3f}{stats['mean'] * 1000:>10.2f}"
+                     f"{stats['p95'] * 1000:>10.2f}{stats['max'] * 1000:>10.2f}")
+    return "\n".join(lines)
+
+
+def export_json(path: str):
+    with open(path, "w") as file:
+        json.dump(summary(), file, indent=2)
+
+
+def export_chrome_trace(path: str):
+    # complete ("X") events in microseconds, open the file in chrome://tracing or ui.perfetto.dev
+    with _lock:
+        trace = [{"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": tid}
+                 for name, start, duration, pid, tid in events]
+    with open(path, "w") as file:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
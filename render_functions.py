@@ -4,19 +4,120 @@ import random
 import time
 
 import entity_maker
-from engine import Engine
+import tcod.console
+import tcod.event
 from tcod import CENTER, RIGHT, LEFT, BKGND_ALPHA
 from typing import TYPE_CHECKING
 import tile_types
 import numpy as np
 import settings
 import colors
-from main import WIDTH, HEIGHT
+from settings import WIDTH, HEIGHT
 
+# the engine (and with it numba and the map generators) is only needed for type hints, so the main menu can render
+# before any of it has loaded
 if TYPE_CHECKING:
+    from architect import Floor
+    from engine import Engine
+    from event_handler import BaseEventHandler
     from god_bargains import GodBargain
 
 
+# the graphic for every palette id at each light level: id * 3 is unexplored, + 1 remembered (dark), + 2 in view (light)
+GRAPHICS = np.zeros(len(tile_types.PALETTE) * 3, dtype=tcod.console.rgb_graphic)
+GRAPHICS[0::3] = tile_types.SHROUD
+GRAPHICS[1::3] = tile_types.PALETTE["dark"]
+GRAPHICS[2::3] = tile_types.PALETTE["light"]
+
+# events that can't change anything on screen, they don't cause a frame
+IDLE_EVENTS = (tcod.event.MouseMotion, tcod.event.MouseButtonUp, tcod.event.MouseWheel, tcod.event.KeyUp,
+               tcod.event.TextInput)
+
+
+class RenderState:
+    # what the console was last drawn from, so a frame only redraws the regions whose inputs changed and only gets
+    # presented when something was redrawn. switching to another kind of handler or console redraws everything, a
+    # new handler of the same kind (like the PlayerMoverHandler every turn makes) draws the same screen
+    def __init__(self):
+        self.keys: dict[str, tuple] = {}
+        self.screen: type | None = None
+        self.console = None
+        self.dirty = True
+        self.drew = False
+        self.graphics: FloorGraphics | None = None
+
+    def graphics_for(self, floor: Floor) -> FloorGraphics:
+        # only the floor being played is kept, the next one starts fresh
+        if self.graphics is None or self.graphics.floor is not floor:
+            self.graphics = FloorGraphics(floor)
+        return self.graphics
+
+    def invalidate(self):
+        # redraw every region next frame, for changes the region keys can't see (like revealing the map)
+        self.keys.clear()
+        self.dirty = True
+
+    def event_handled(self, event: tcod.event.Event):
+        if isinstance(event, tcod.event.WindowEvent):
+            # resized or uncovered, the window needs presenting even though nothing changed
+            self.invalidate()
+        elif not isinstance(event, IDLE_EVENTS):
+            self.dirty = True
+
+    def changed(self, region: str, key: tuple) -> bool:
+        # true (and the region counts as drawn) if the things a region is drawn from aren't what they were last frame
+        if self.keys.get(region) == key:
+            return False
+        self.keys[region] = key
+        self.drew = True
+        return True
+
+
+class FloorGraphics:
+    # a floor's tiles as palette ids, refreshed when its version changes, and the index buffers frames get composed
+    # in so drawing the map allocates nothing once they exist
+    def __init__(self, floor: Floor):
+        self.floor = floor
+        self.version = -1
+        self.ids: np.ndarray | None = None
+        self.indexes: dict[tuple[int, int], np.ndarray] = {}
+
+    def compose(self, out: np.ndarray, x1: int, y1: int, visible: np.ndarray | None, explored: np.ndarray):
+        # writes the graphics of the map window starting at x1, y1 (the size of out) straight into out. visible
+        # tiles are lit and explored ones dark, without visible everything explored is lit
+        if self.version != self.floor.version:
+            self.ids = tile_types.to_ids(self.floor.tiles)
+            self.version = self.floor.version
+
+        shape = out.shape
+        if shape not in self.indexes:
+            self.indexes[shape] = np.empty(shape, dtype=np.int16, order="F")
+        index = self.indexes[shape]
+        x2, y2 = x1 + shape[0], y1 + shape[1]
+
+        # visible tiles are always explored, so explored + visible is the light level
+        np.multiply(self.ids[x1:x2, y1:y2], 3, out=index)
+        np.add(index, explored[x1:x2, y1:y2], out=index)
+        np.add(index, explored[x1:x2, y1:y2] if visible is None else visible[x1:x2, y1:y2], out=index)
+        np.take(GRAPHICS, index, out=out, mode="clip")
+
+
+def render_frame(handler: BaseEventHandler) -> bool:
+    # draws the handler's screen if anything could have changed, returns whether the console needs presenting
+    engine, state = handler.engine, handler.engine.render_state
+    if type(handler) is not state.screen or engine.console is not state.console:
+        state.screen, state.console = type(handler), engine.console
+        state.invalidate()
+    if not state.dirty:
+        return False
+
+    # handlers that don't track regions redraw everything whenever they render
+    state.drew = not handler.tracks_regions
+    handler.on_render()
+    state.dirty = False
+    return state.drew
+
+
 def render_main_screen_player(engine: Engine):
     player_x, player_y = engine.player.x, engine.player.y
     if player_x - WIDTH//2 < 0:
@@ -37,34 +138,43 @@ def render_main_screen_player(engine: Engine):
         if HEIGHT % 2 == 1:
             camera_y2 += 1
 
-    engine.console.tiles_rgb[0:WIDTH, 0:HEIGHT] = np.select(
-        condlist=[engine.game_map.visible[camera_x1:camera_x2, camera_y1:camera_y2],
-                  engine.game_map.explored[camera_x1:camera_x2, camera_y1:camera_y2]],
-        choicelist=[engine.game_map.tiles[camera_x1:camera_x2, camera_y1:camera_y2]["light"],
-                    engine.game_map.tiles[camera_x1:camera_x2, camera_y1:camera_y2]["dark"]],
-        default=tile_types.SHROUD,
-    )
+    engine.render_state.graphics_for(engine.game_map).compose(
+        engine.console.tiles_rgb[0:WIDTH, 0:HEIGHT], camera_x1, camera_y1,
+        engine.game_map.visible, engine.game_map.explored)
+
+    # every explored entity on screen in one scatter, higher ids draw over lower ones on the same tile
+    entities = engine.entities
+    ids = entities.ids()
+    xs, ys = entities.x[ids], entities.y[ids]
+    shown = in_camera(xs, ys, camera_x1, camera_y1, camera_x2, camera_y2)
+    ids, xs, ys = ids[shown], xs[shown], ys[shown]
+    shown = engine.game_map.explored[xs, ys]
+    engine.console.tiles_rgb[xs[shown] - camera_x1, ys[shown] - camera_y1] = entities.graphic[ids[shown]]
+
+    # the tiles monsters are about to charge through, clipped to the camera since they can run off screen
+    targets = [xy for monster in entities.of_type(entity_maker.Monster) for xy in monster.target_tiles]
+    if targets:
+        xs, ys = np.array(targets).T
+        shown = in_camera(xs, ys, camera_x1, camera_y1, camera_x2, camera_y2)
+        xs, ys = xs[shown], ys[shown]
+        shown = engine.game_map.visible[xs, ys]
+        engine.console.tiles_rgb["bg"][xs[shown] - camera_x1, ys[shown] - camera_y1] = colors.DARK_RED
 
-    for entity in engine.entities:
-        if engine.game_map.explored[entity.x, entity.y]:
-            if entity.x in range(camera_x1, camera_x2) and entity.y in range(camera_y1, camera_y2):
-                engine.console.tiles_rgb[entity.x-camera_x1, entity.y-camera_y1] = entity.graphic
-        if type(entity) is entity_maker.Monster:
-            for (x, y) in entity.target_tiles:
-                if engine.game_map.visible[x, y]:
-                    # TODO bug: index 66 is out of bounds for axis 1 with size 55 (monster at bottom of screen)
-                    engine.console.tiles_rgb["bg"][x - camera_x1, y - camera_y1] = colors.DARK_RED
+
+def in_camera(xs: np.ndarray, ys: np.ndarray, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+    # mask of the coordinates inside the camera rectangle, x2 and y2 not included
+    return (xs >= x1) & (xs < x2) & (ys >= y1) & (ys < y2)
 
 
 def render_main_screen_map(engine: Engine):
-    engine.console.tiles_rgb[0:engine.game_map.width, 0:engine.game_map.height] = np.select(
-        condlist=[engine.game_map.explored],
-        choicelist=[engine.game_map.tiles["light"]],
-        default=tile_types.SHROUD,
-    )
+    engine.render_state.graphics_for(engine.game_map).compose(
+        engine.console.tiles_rgb[0:engine.game_map.width, 0:engine.game_map.height], 0, 0,
+        None, engine.game_map.explored)
 
 
 def render_ui_map_builder(engine: Engine):
+    clear_bottom_bar(engine, engine.game_map.height)
+
     # print the bottom line instuctions
     engine.console.print(int(engine.game_map.width / 4), engine.game_map.height + 1,
                          "'I': instructions    'O': options",
@@ -82,11 +192,12 @@ def render_ui_map_builder(engine: Engine):
 
 # TODO will this update off-screen entities?
 def render_entities_map(engine: Engine):
-    for entity in engine.entities:
-        if not entity.x or not entity.y:
-            continue
-        if engine.game_map.explored[entity.x, entity.y]:
-            engine.console.tiles_rgb[entity.x, entity.y] = entity.graphic
+    entities = engine.entities
+    ids = entities.ids()
+    ids = ids[(entities.x[ids] > 0) & (entities.y[ids] > 0)]
+    xs, ys = entities.x[ids], entities.y[ids]
+    shown = engine.game_map.explored[xs, ys]
+    engine.console.tiles_rgb[xs[shown], ys[shown]] = entities.graphic[ids[shown]]
 
 
 def render_settings(engine: Engine):
@@ -194,10 +305,10 @@ def draw_center_frame(engine: Engine, y_offset: int, title: str):
                               )
 
 
-def render_main_menu(engine: Engine):
-    engine.console.print(
-        engine.console.width // 2,
-        engine.console.height // 2 - 4,
+def render_main_menu(console: tcod.console.Console):
+    console.print(
+        console.width // 2,
+        console.height // 2 - 4,
         "Faith in the Crystal",
         fg=colors.CRYSTAL,
         alignment=CENTER,
@@ -207,9 +318,9 @@ def render_main_menu(engine: Engine):
     for i, text in enumerate(
             ["[M]ap Maker", "[P]lay the \"Game\""]
     ):
-        engine.console.print(
-            engine.console.width // 2,
-            engine.console.height // 2 - 2 + i,
+        console.print(
+            console.width // 2,
+            console.height // 2 - 2 + i,
             text.ljust(menu_width),
             fg=colors.WHITE,
             bg=colors.BLACK,
@@ -230,7 +341,15 @@ def render_loading_screen(engine: Engine):
     engine.context.present(engine.console)
 
 
+def clear_bottom_bar(engine: Engine, y: int):
+    # blank everything below the map, the bar gets redrawn without clearing the whole console
+    engine.console.draw_rect(0, y, engine.console.width, engine.console.height - y, ch=ord(' '),
+                             fg=colors.WHITE, bg=colors.BLACK)
+
+
 def render_bottom_bar_player(engine: Engine):
+    clear_bottom_bar(engine, HEIGHT)
+
     # print the bottom line instuctions
     engine.console.print(1, HEIGHT + 1,
                          f"'?' for help",
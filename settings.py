@@ -1,6 +1,13 @@
 # in game settings with their default and increments
 from tcod import event
 
+# screen size in tiles. kept here instead of main so the renderer doesn't have to import main
+# TODO There's an error when one of these two/2 returns an odd value, needs a rework
+WIDTH, HEIGHT, MAP_Y_OFFSET = 68, 52, 3
+
+# most frames drawn per second, events that come in faster than this get handled together in one frame
+TARGET_FPS = 60
+
 
 class Setting:
     def __init__(self, hotkey, minimum, maximum, val, inc):
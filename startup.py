@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import importlib
+import threading
+import time
+
+# the map generation stack, in the order it gets imported. numba goes first so its cost isn't hidden inside architect,
+# and each module's time is only what it adds on top of the ones before it
+GENERATION_MODULES = ["numba", "architect", "test_functions", "engine", "actions", "event_handler"]
+
+STARTED = time.perf_counter()
+
+# seconds spent on each step of startup, filled in as they finish
+timings: dict[str, float] = {}
+
+_loader: threading.Thread | None = None
+
+
+def load_generation_stack():
+    # import everything the map builder and game need, then compile (or load) the numba kernels
+    for name in GENERATION_MODULES:
+        tick = time.perf_counter()
+        importlib.import_module(name)
+        timings[f"import {name}"] = time.perf_counter() - tick
+
+    architect = importlib.import_module("architect")
+    for kernel, seconds in architect.warm_up().items():
+        timings[f"compile {kernel}"] = seconds
+
+    # get the processes that build floor features going too, they load their kernels on their own
+    importlib.import_module("engine").prestart_feature_pool()
+
+
+def preload() -> threading.Thread:
+    # start loading the generation stack on a background thread while the window and main menu come up
+    global _loader
+    if _loader is None:
+        _loader = threading.Thread(target=load_generation_stack, name="generation stack loader", daemon=True)
+        _loader.start()
+    return _loader
+
+
+def loading() -> bool:
+    # true while the background loader is still going
+    return _loader is not None and _loader.is_alive()
+
+
+def wait():
+    # block until the generation stack is loaded, loading it here if preload was never called
+    if _loader is None:
+        load_generation_stack()
+    else:
+        _loader.join()
+
+
+def mark(name: str):
+    # record how long after startup something happened, e.g. the first menu frame
+    timings[name] = time.perf_counter() - STARTED
+
+
+def report() -> str:
+    # one line per step, slowest first
+    lines = [f"{name:<32}{seconds * 1000:9.1f} ms" for name, seconds in
+             sorted(timings.items(), key=lambda item: item[1], reverse=True)]
+    return "\n".join(["Startup times:"] + lines)
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from typing import Tuple
 import colors
 
@@ -78,3 +80,27 @@ acid = new_tile(
     light=(176, colors.ACID_GREEN, colors.DARK_GREY),
     dark=(176, colors.OLIVE_GREEN, colors.BLACK)
 )
+
+
+# every tile type gets an index into the palette, so a map can be stored as one uint8 per cell instead of a full tile
+PALETTE = np.stack([floor, wall, filled, down_stairs, acid])
+FLOOR_ID, WALL_ID, FILLED_ID, DOWN_STAIRS_ID, ACID_ID = range(len(PALETTE))
+
+
+def to_ids(tiles: np.ndarray) -> np.ndarray:
+    # one structured comparison per palette entry rather than per cell
+    ids = np.full(tiles.shape, WALL_ID, dtype=np.uint8, order="F")
+    for i, tile in enumerate(PALETTE):
+        ids[tiles == tile] = i
+    return ids
+
+
+class TileMap:
+    # compact map storage: a uint8 palette index per cell, PALETTE[ids] turns it back into tiles
+    def __init__(self, ids: np.ndarray):
+        self.ids = np.asarray(ids, dtype=np.uint8, order="F")
+        self.width, self.height = self.ids.shape
+
+    @classmethod
+    def from_tiles(cls, tiles: np.ndarray) -> TileMap:
+        return cls(to_ids(tiles))